@@ -2,13 +2,13 @@ import os
 import re
 import logging
 import tempfile
-import pdfkit
 import json
 import bleach
 import string
 import random
 import sqlite3
 import requests
+import base64
 import stripe
 import time
 import socket
@@ -16,20 +16,33 @@ import ipaddress
 import threading
 import io
 import uuid
+import zipfile
+import fcntl
+import shutil
+import subprocess
+import hashlib
+import mmap
+import struct
 import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Flask, request, jsonify, send_file, redirect, current_app, render_template_string, abort
+from flask import Flask, Response, request, jsonify, send_file, redirect, current_app, render_template_string, abort
 from flask_cors import CORS
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email
 from markdown2 import markdown
-from pydub import AudioSegment
-from docx import Document
+from converter import CONVERTER_VERSION, conversion_kind, ffmpeg_command, run_conversion, warm_up
 
 # Optional Rate Limiting
 try:
@@ -59,6 +72,7 @@ EBAY_OAUTH_TOKEN = os.getenv('EBAY_OAUTH_TOKEN')
 EBAY_CLIENT_ID = os.getenv('EBAY_CLIENT_ID')
 EBAY_CLIENT_SECRET = os.getenv('EBAY_CLIENT_SECRET')
 EBAY_REFRESH_TOKEN = os.getenv('EBAY_REFRESH_TOKEN')
+EBAY_API_BASE = os.getenv('EBAY_API_BASE', 'https://api.ebay.com')
 
 if not SENDGRID_API_KEY:
     raise RuntimeError("SENDGRID_API_KEY is required")
@@ -89,11 +103,625 @@ ALLOWED_MIME_TYPES = {
     'audio/mpeg', 'audio/wav', 'audio/ogg'
 }
 
-with open("cards.json", "r", encoding="utf-8") as f:
-    ALL_CARDS = json.load(f)["data"]
-CARD_LOOKUP = {str(card["id"]): card for card in ALL_CARDS}
 
-generation_jobs = {}
+# ----------------------------------------------------------------------------------------------------------------------
+# Outbound HTTP
+# ----------------------------------------------------------------------------------------------------------------------
+# One shared keep-alive session for eBay, Discord and YGOPRODeck so repeated calls reuse TCP+TLS connections. Each
+# host gets its own pool sized to the eBay lookup scheduler, and every call gets connect/read timeouts.
+EBAY_LOOKUP_WORKERS = int(os.getenv('EBAY_LOOKUP_WORKERS', '8'))
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_MAXSIZE = max(EBAY_LOOKUP_WORKERS, int(os.getenv('HTTP_POOL_MAXSIZE', '8')))
+HTTP_TIMEOUT = (float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')), float(os.getenv('HTTP_READ_TIMEOUT', '20')))
+
+
+def make_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = make_http_session()
+
+
+def http_request(method, url, **kwargs):
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    return http_session.request(method, url, **kwargs)
+
+
+def http_pool_summary():
+    pools = []
+    for adapter in set(http_session.adapters.values()):
+        manager = adapter.poolmanager
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': idle,
+                'maxsize': HTTP_POOL_MAXSIZE,
+            })
+    return pools
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Card Search Index
+# ----------------------------------------------------------------------------------------------------------------------
+SEARCH_RESULT_LIMIT = 25
+FUZZY_CANDIDATE_LIMIT = 64
+WORD_BOUNDARY_REGEX = re.compile(r'(?<![a-z0-9])[a-z0-9]')
+CARD_FIELD_REGEX = re.compile(r'^[a-z_]{1,32}$')
+
+
+def card_summary(card):
+    # Compact shape for dropdowns: enough to label the card and show its thumbnail / hover preview
+    image = (card.get('card_images') or [{}])[0]
+    return {
+        'id': card.get('id'),
+        'name': card.get('name'),
+        'type': card.get('type'),
+        'image_url_small': image.get('image_url_small'),
+        'image_url': image.get('image_url'),
+    }
+
+
+def parse_card_fields(raw, default):
+    # fields=summary | full | comma separated top-level keys (e.g. "id,name,card_prices")
+    if raw is None or raw == '':
+        return default
+    if isinstance(raw, list):
+        raw = ','.join(str(f) for f in raw)
+    raw = raw.strip().lower()
+    if raw in ('summary', 'full'):
+        return raw
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    if not fields or not all(CARD_FIELD_REGEX.match(f) for f in fields):
+        return None
+    return fields
+
+
+def project_card(card, fields):
+    if fields == 'full':
+        return card
+    if fields == 'summary':
+        return card_summary(card)
+    return {key: card[key] for key in fields if key in card}
+
+
+def summary_response(summaries, key):
+    # Stitch the pre-serialized summaries together instead of running jsonify over card dicts
+    body = b'{"' + key.encode() + b'":[' + b','.join(summaries) + b']}'
+    return app.response_class(body, mimetype='application/json')
+
+
+def name_grams(name):
+    # Distinct 2- and 3-grams of a lowercased name
+    return dict.fromkeys(name[i:i + size] for size in (2, 3) for i in range(len(name) - size + 1))
+
+
+def name_word_starts(name, pos):
+    return [(name[match.start():], pos) for match in WORD_BOUNDARY_REGEX.finditer(name) if match.start() > 0]
+
+
+def exact_name_positions(names):
+    exact = {}
+    for pos, name in enumerate(names):
+        exact.setdefault(name, []).append(pos)
+    return exact
+
+
+def build_search_index(ids, names):
+    # Lowercased name column plus an inverted index of every 2- and 3-gram -> card positions.
+    # Postings are kept in catalog order so the first hits are the same cards a full scan would find.
+    names = [name.lower() for name in names]
+    grams = {}
+    for pos, name in enumerate(names):
+        for gram in name_grams(name):
+            grams.setdefault(gram, []).append(pos)
+
+    # Sorted name and word-start columns for the ranked mode's prefix / word-boundary tiers
+    word_starts = []
+    for pos, name in enumerate(names):
+        word_starts.extend(name_word_starts(name, pos))
+    word_starts.sort()
+
+    return {
+        'ids': list(ids),
+        'names': names,
+        'grams': {gram: array('I', postings) for gram, postings in grams.items()},
+        'exact': exact_name_positions(names),
+        'sorted_names': sorted((name, pos) for pos, name in enumerate(names)),
+        'word_starts': word_starts,
+    }
+
+
+def patch_search_index(index, ids, names):
+    # Carry the previous snapshot's index over to the new one. Only cards that were added, removed or renamed get
+    # (re)tokenized; the other postings are just renumbered from the first kept card that moved, if any did.
+    # The old index is left untouched for requests still using it.
+    names = [name.lower() for name in names]
+    old_names = index['names']
+    old_positions = {card_id: pos for pos, card_id in enumerate(index['ids'])}
+    remap = array('i', [-1]) * len(old_names)
+    added = []
+    for pos, card_id in enumerate(ids):
+        old = old_positions.get(card_id)
+        if old is not None and old_names[old] == names[pos]:
+            remap[old] = pos
+        else:
+            added.append(pos)
+    first_moved = next((old for old, pos in enumerate(remap) if pos >= 0 and old != pos), len(remap))
+    dropped = [old for old in range(first_moved) if remap[old] < 0]
+    if first_moved == len(remap) and not dropped and not added:
+        return index
+
+    grams = dict(index['grams'])
+    for old in dropped:
+        for gram in name_grams(old_names[old]):
+            postings = grams[gram]
+            i = bisect_left(postings, old)
+            grams[gram] = postings[:i] + postings[i + 1:]
+    if first_moved < len(remap):
+        for gram, postings in grams.items():
+            start = bisect_left(postings, first_moved)
+            if start < len(postings):
+                grams[gram] = postings[:start] + array('I', sorted(remap[pos] for pos in postings[start:]
+                                                                   if remap[pos] >= 0))
+    added_postings = {}
+    for pos in added:
+        for gram in name_grams(names[pos]):
+            added_postings.setdefault(gram, []).append(pos)
+    for gram, positions in added_postings.items():
+        grams[gram] = array('I', sorted([*grams.get(gram, ()), *positions]))
+
+    sorted_names = [(name, remap[pos]) for name, pos in index['sorted_names'] if remap[pos] >= 0]
+    word_starts = [(suffix, remap[pos]) for suffix, pos in index['word_starts'] if remap[pos] >= 0]
+    for pos in added:
+        sorted_names.append((names[pos], pos))
+        word_starts.extend(name_word_starts(names[pos], pos))
+    sorted_names.sort()
+    word_starts.sort()
+
+    return {
+        'ids': list(ids),
+        'names': names,
+        'grams': {gram: postings for gram, postings in grams.items() if postings},
+        'exact': exact_name_positions(names),
+        'sorted_names': sorted_names,
+        'word_starts': word_starts,
+    }
+
+
+def search_index_lookup(index, query, limit=SEARCH_RESULT_LIMIT):
+    # Walk the rarest gram's postings and verify each candidate with a plain substring test
+    names = index['names']
+    size = 3 if len(query) >= 3 else 2
+    shortest = None
+    for i in range(len(query) - size + 1):
+        postings = index['grams'].get(query[i:i + size])
+        if postings is None:
+            return []
+        if shortest is None or len(postings) < len(shortest):
+            shortest = postings
+    if shortest is None:
+        return []
+
+    matches = []
+    for pos in shortest:
+        if query in names[pos]:
+            matches.append(pos)
+            if len(matches) >= limit:
+                break
+    return matches
+
+
+def prefix_edit_distance(query, name, max_distance):
+    # Edit distance between query and the closest prefix of name (so typos in a partial name still match),
+    # computed on a diagonal band and capped at max_distance + 1
+    name = name[:len(query) + max_distance]
+    over = max_distance + 1
+    previous = list(range(len(name) + 1))
+    for i, ch in enumerate(query, start=1):
+        current = [i] + [over] * len(name)
+        lo, hi = max(1, i - max_distance), min(len(name), i + max_distance)
+        for j in range(lo, hi + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ch != name[j - 1]))
+        if min(current) > max_distance:
+            return over
+        previous = current
+    return min(min(previous), over)
+
+
+def prefix_range(sorted_pairs, prefix):
+    # Yield positions whose key starts with prefix from a sorted (key, pos) list
+    i = bisect_left(sorted_pairs, (prefix,))
+    while i < len(sorted_pairs) and sorted_pairs[i][0].startswith(prefix):
+        yield sorted_pairs[i][1]
+        i += 1
+
+
+def fuzzy_candidates(index, query, max_distance, limit=FUZZY_CANDIDATE_LIMIT):
+    # q-gram filter: a name within k edits of the query shares at least (grams - 3k) trigrams with it.
+    # Only the best-overlapping candidates go on to the (comparatively slow) edit distance check.
+    grams = {query[i:i + 3] for i in range(len(query) - 2)}
+    needed = max(1, len(grams) - 3 * max_distance)
+    counts = Counter()
+    for gram in grams:
+        counts.update(index['grams'].get(gram, ()))
+    return [pos for pos, count in counts.most_common(limit) if count >= needed]
+
+
+def ranked_search(index, query, limit=SEARCH_RESULT_LIMIT):
+    # Tiers: exact name, name prefix, word-boundary prefix, any substring, then typo-tolerant matches
+    names = index['names']
+    results = []
+    seen = set()
+
+    def take(positions):
+        for pos in positions:
+            if pos not in seen:
+                seen.add(pos)
+                results.append(pos)
+                if len(results) >= limit:
+                    return True
+        return False
+
+    if take(index['exact'].get(query, ())):
+        return results
+    if take(prefix_range(index['sorted_names'], query)):
+        return results
+    if take(prefix_range(index['word_starts'], query)):
+        return results
+    if take(search_index_lookup(index, query, limit=limit + len(seen))):
+        return results
+
+    if len(query) >= 4:
+        max_distance = 1 if len(query) < 8 else 2
+        scored = []
+        for pos in fuzzy_candidates(index, query, max_distance):
+            if pos in seen:
+                continue
+            distance = prefix_edit_distance(query, names[pos], max_distance)
+            if distance <= max_distance:
+                scored.append((distance, len(names[pos]), pos))
+        scored.sort()
+        take(pos for _, _, pos in scored)
+    return results
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Card Catalog
+# ----------------------------------------------------------------------------------------------------------------------
+# cards.json is converted once into a read-only SQLite file. Workers open it with mmap so the card data lives in the
+# shared page cache, and only the rows a request asks for are decoded. Each worker keeps just the name search index.
+#
+# Catalog files are immutable, numbered snapshots (cards.<generation>.db). The current generation number lives in a
+# tiny shared file every worker keeps mmapped; a refresh writes the next snapshot and then bumps that number. Workers
+# compare it on each request and swap in the new snapshot, so one refresh serves the whole host, and the card data is
+# paid for once in the page cache instead of once per worker. Requests grab the catalog once, so they never see
+# half of an update.
+CARDS_JSON = 'cards.json'
+CARD_CATALOG_PATH = os.getenv('CARD_CATALOG_PATH', 'cards.db')
+CATALOG_GENERATION_PATH = f"{CARD_CATALOG_PATH}.gen"
+CATALOG_SNAPSHOTS_KEPT = 3
+CATALOG_MMAP_BYTES = int(os.getenv('CATALOG_MMAP_MB', '256')) * 1024 * 1024
+CATALOG_QUERY_CHUNK = 500
+CATALOG_SCHEMA_VERSION = 2
+YGOPRODECK_CARDS_URL = os.getenv('YGOPRODECK_CARDS_URL', 'https://db.ygoprodeck.com/api/v7/cardinfo.php')
+YGOPRODECK_DBVER_URL = os.getenv('YGOPRODECK_DBVER_URL', 'https://db.ygoprodeck.com/api/v7/checkDBVer.php')
+CARD_REFRESH_INTERVAL = int(os.getenv('CARD_REFRESH_INTERVAL', '21600'))  # 6 hours
+CARD_WATCH_INTERVAL = int(os.getenv('CARD_WATCH_INTERVAL', '60'))
+catalog_reload_lock = threading.Lock()
+
+
+def catalog_snapshot_path(generation):
+    root, ext = os.path.splitext(CARD_CATALOG_PATH)
+    return f"{root}.{generation}{ext}"
+
+
+def open_generation_file():
+    fd = os.open(CATALOG_GENERATION_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < 8:
+            os.ftruncate(fd, 8)
+        return mmap.mmap(fd, 8)
+    finally:
+        os.close(fd)
+
+
+def read_catalog_generation():
+    return struct.unpack_from('<Q', CATALOG_GENERATION, 0)[0]
+
+
+def catalog_snapshot_generations():
+    root, ext = os.path.splitext(CARD_CATALOG_PATH)
+    prefix = f"{os.path.basename(root)}."
+    generations = []
+    for name in os.listdir(os.path.dirname(root) or '.'):
+        number = name[len(prefix):-len(ext)] if name.startswith(prefix) and name.endswith(ext) else ''
+        if number.isdigit():
+            generations.append(int(number))
+    return generations
+
+
+def publish_catalog_generation(generation):
+    struct.pack_into('<Q', CATALOG_GENERATION, 0, generation)
+    CATALOG_GENERATION.flush()
+    # Older snapshots can go once no worker still uses them. Each worker holds a shared lock on its snapshot for as
+    # long as that catalog is referenced (see open_card_catalog), so connections opened lazily per thread never find
+    # the file gone; snapshots still locked are left for a later publish to clean up.
+    for old in catalog_snapshot_generations():
+        if old > generation - CATALOG_SNAPSHOTS_KEPT:
+            continue
+        path = catalog_snapshot_path(old)
+        try:
+            with open(path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+
+
+def catalog_row(pos, card):
+    data = json.dumps(card, separators=(',', ':')).encode()
+    summary = json.dumps(card_summary(card), separators=(',', ':')).encode()
+    return str(card['id']), pos, card.get('name', ''), hashlib.sha1(data).hexdigest(), summary, data
+
+
+def write_card_catalog(catalog_path, rows, meta, base_path=None, diff=None):
+    # Write a full catalog from rows, or copy base_path and apply diff to it. Either way the result is built in a
+    # temp file and renamed into place, so readers only ever open complete snapshots.
+    tmp_path = f"{catalog_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if base_path and diff is not None:
+        shutil.copyfile(base_path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        if base_path and diff is not None:
+            conn.executemany('DELETE FROM cards WHERE id = ?', ((card_id,) for card_id in diff['removed']))
+            conn.executemany('INSERT OR REPLACE INTO cards (id, pos, name, hash, summary, data) VALUES (?, ?, ?, ?, ?, ?)',
+                             diff['upserts'])
+            conn.executemany('UPDATE cards SET pos = ? WHERE id = ?', diff['moved'])
+        else:
+            conn.execute('''
+                CREATE TABLE cards (
+                    id TEXT PRIMARY KEY,
+                    pos INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    summary BLOB NOT NULL,
+                    data BLOB NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX cards_pos ON cards (pos)')
+            conn.execute(f'PRAGMA user_version = {CATALOG_SCHEMA_VERSION}')
+            conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            conn.executemany('INSERT INTO cards (id, pos, name, hash, summary, data) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, catalog_path)
+    return catalog_path
+
+
+def build_card_catalog(source_path, catalog_path):
+    with open(source_path, "r", encoding="utf-8") as f:
+        cards = json.load(f)["data"]
+    write_card_catalog(catalog_path, [catalog_row(pos, card) for pos, card in enumerate(cards)], {})
+    logger.info("Built card catalog %s with %d cards", catalog_path, len(cards))
+    return catalog_path
+
+
+def open_card_catalog(generation, index=None):
+    # index is the previous snapshot's search index, patched rather than rebuilt when given
+    path = catalog_snapshot_path(generation)
+    # Released when the catalog is dropped, i.e. once the last request using this snapshot is done
+    lock = open(path, 'rb')
+    fcntl.flock(lock, fcntl.LOCK_SH)
+    conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    try:
+        rows = conn.execute('SELECT id, name FROM cards ORDER BY pos').fetchall()
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+    finally:
+        conn.close()
+    ids = [row[0] for row in rows]
+    names = [row[1] for row in rows]
+    index = build_search_index(ids, names) if index is None else patch_search_index(index, ids, names)
+    return {'path': path, 'generation': generation, 'meta': meta, 'index': index, 'local': threading.local(),
+            'lock': lock}
+
+
+def catalog_schema_version(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def load_card_catalog():
+    # Only one worker converts cards.json; the rest wait on the lock and open the result
+    with open(f"{CARD_CATALOG_PATH}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            generation = read_catalog_generation()
+            path = catalog_snapshot_path(generation)
+            if (not generation or not os.path.exists(path)
+                    or catalog_schema_version(path) != CATALOG_SCHEMA_VERSION
+                    or os.path.getmtime(CARDS_JSON) > os.path.getmtime(path)):
+                generation += 1
+                build_card_catalog(CARDS_JSON, catalog_snapshot_path(generation))
+                publish_catalog_generation(generation)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return open_card_catalog(generation)
+
+
+def current_catalog():
+    # Per-request check of the shared generation number. The first request to notice a new one starts loading it in
+    # the background and everyone keeps using the current snapshot until the swap.
+    catalog = CARD_CATALOG
+    generation = read_catalog_generation()
+    if generation != catalog['generation'] and catalog_reload_lock.acquire(blocking=False):
+        threading.Thread(target=switch_card_catalog, args=(generation,), daemon=True).start()
+    return catalog
+
+
+def switch_card_catalog(generation):
+    global CARD_CATALOG
+    try:
+        if generation != CARD_CATALOG['generation']:
+            CARD_CATALOG = open_card_catalog(generation, index=CARD_CATALOG['index'])
+            logger.info("Switched to card catalog generation %d", generation)
+    except Exception:
+        logger.exception("Failed to open card catalog generation %d", generation)
+    finally:
+        catalog_reload_lock.release()
+
+
+def catalog_connection(catalog):
+    # One read-only connection per thread per catalog snapshot
+    conn = getattr(catalog['local'], 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{catalog['path']}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        conn.execute(f'PRAGMA mmap_size={CATALOG_MMAP_BYTES}')
+        catalog['local'].conn = conn
+    return conn
+
+
+def fetch_catalog_column(catalog, column, key, values):
+    # {key value: column value} for the requested rows, e.g. ('data', 'id', ids) or ('summary', 'pos', positions)
+    conn = catalog_connection(catalog)
+    values = list(dict.fromkeys(values))
+    rows = {}
+    for i in range(0, len(values), CATALOG_QUERY_CHUNK):
+        chunk = values[i:i + CATALOG_QUERY_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        rows.update(conn.execute(f'SELECT {key}, {column} FROM cards WHERE {key} IN ({placeholders})', chunk))
+    return rows
+
+
+def get_catalog_cards(catalog, ids):
+    # Full card dicts for the given ids (unknown ids skipped, duplicates kept, request order preserved)
+    rows = fetch_catalog_column(catalog, 'data', 'id', ids)
+    decoded = {card_id: json.loads(data) for card_id, data in rows.items()}
+    return [decoded[card_id] for card_id in ids if card_id in decoded]
+
+
+def get_catalog_cards_by_name(catalog, names):
+    # {catalog name: full card} for the names that match a card exactly (case-insensitively)
+    exact = catalog['index']['exact']
+    positions = [exact[name.lower()][0] for name in names if name.lower() in exact]
+    rows = fetch_catalog_column(catalog, 'data', 'pos', positions)
+    return {card['name']: card for card in map(json.loads, rows.values())}
+
+
+def diff_card_catalog(catalog, cards):
+    # Compare a fresh dump against the current snapshot by per-card content hash
+    conn = catalog_connection(catalog)
+    current = {card_id: (pos, card_hash) for card_id, pos, card_hash in conn.execute('SELECT id, pos, hash FROM cards')}
+    diff = {'added': [], 'changed': [], 'removed': [], 'upserts': [], 'moved': []}
+    seen = set()
+    for pos, card in enumerate(cards):
+        row = catalog_row(pos, card)
+        card_id, card_hash = row[0], row[3]
+        seen.add(card_id)
+        if card_id not in current:
+            diff['added'].append(card_id)
+            diff['upserts'].append(row)
+        elif current[card_id][1] != card_hash:
+            diff['changed'].append(card_id)
+            diff['upserts'].append(row)
+        elif current[card_id][0] != pos:
+            diff['moved'].append((pos, card_id))
+    diff['removed'] = [card_id for card_id in current if card_id not in seen]
+    return diff
+
+
+def fetch_card_db_version():
+    # YGOPRODeck's cheap "has anything changed" endpoint; an empty string means unknown
+    try:
+        resp = http_request('GET', YGOPRODECK_DBVER_URL)
+        data = resp.json() if resp.ok else None
+        return str(data[0].get('database_version', '')) if data else ''
+    except Exception:
+        logger.warning("Could not check YGOPRODeck database version")
+        return ''
+
+
+def download_card_dump(meta):
+    # Conditional GET streamed to a temp file; returns (cards, validators) or None when nothing changed
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    tmp_path = f"{CARDS_JSON}.{os.getpid()}.tmp"
+    with http_request('GET', YGOPRODECK_CARDS_URL, headers=headers, stream=True) as resp:
+        if resp.status_code == 304:
+            return None
+        if resp.status_code != 200:
+            logger.warning("Failed to update cards.json (status code %s)", resp.status_code)
+            return None
+        with open(tmp_path, 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=65536):
+                f.write(chunk)
+        validators = {'etag': resp.headers.get('ETag', ''), 'last_modified': resp.headers.get('Last-Modified', '')}
+    try:
+        with open(tmp_path, "r", encoding="utf-8") as f:
+            cards = json.load(f)["data"]
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, CARDS_JSON)
+    return cards, validators
+
+
+def refresh_card_catalog():
+    # Returns the diff that was published, or None when the upstream data hasn't changed
+    global CARD_CATALOG
+    generation = read_catalog_generation()
+    if generation != CARD_CATALOG['generation']:
+        CARD_CATALOG = open_card_catalog(generation, index=CARD_CATALOG['index'])
+    catalog = CARD_CATALOG
+    meta = dict(catalog['meta'])
+
+    dbver = fetch_card_db_version()
+    if dbver and dbver == meta.get('dbver'):
+        logger.info("Card database unchanged (version %s)", dbver)
+        return None
+
+    downloaded = download_card_dump(meta)
+    if downloaded is None:
+        logger.info("Card dump not modified")
+        return None
+    cards, validators = downloaded
+    meta.update(validators)
+    if dbver:
+        meta['dbver'] = dbver
+
+    diff = diff_card_catalog(catalog, cards)
+    generation += 1
+    write_card_catalog(catalog_snapshot_path(generation), None, meta, base_path=catalog['path'], diff=diff)
+    CARD_CATALOG = open_card_catalog(generation, index=catalog['index'])
+    publish_catalog_generation(generation)
+    logger.info("Updated card catalog: %d cards, %d added, %d changed, %d removed",
+                len(cards), len(diff['added']), len(diff['changed']), len(diff['removed']))
+    return diff
+
+
+CATALOG_GENERATION = open_generation_file()
+CARD_CATALOG = load_card_catalog()
+
+
 # Store token and its expiry in memory
 ebay_access_token = None
 ebay_token_expiry = 0
@@ -103,29 +731,33 @@ def is_valid_email(email): return EMAIL_REGEX.match(email) is not None
 
 
 def update_cards_periodically():
-    import time
+    # Every worker runs this loop, but only the one holding the leader lock talks to YGOPRODeck; followers pick up
+    # its snapshots through current_catalog()
+    leader_lock = open(f"{CARD_CATALOG_PATH}.leader", 'w')
+    is_leader = False
     while True:
         try:
-            logger.info("Refreshing cards.json from YGOPRODeck...")
-            resp = requests.get("https://db.ygoprodeck.com/api/v7/cardinfo.php", timeout=15)
-            if resp.status_code == 200:
-                with open("cards.json", "w", encoding="utf-8") as f:
-                    f.write(resp.text)
-                global ALL_CARDS, CARD_LOOKUP
-                ALL_CARDS = json.loads(resp.text)["data"]
-                CARD_LOOKUP = {str(card["id"]): card for card in ALL_CARDS}
-                logger.info("Updated cards.json successfully with %d cards.", len(ALL_CARDS))
-            else:
-                logger.warning("Failed to update cards.json (status code %s)", resp.status_code)
-        except Exception as e:
+            if not is_leader:
+                try:
+                    fcntl.flock(leader_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    is_leader = True
+                    logger.info("This worker (pid %d) now refreshes the card catalog", os.getpid())
+                except BlockingIOError:
+                    pass
+            if is_leader:
+                logger.info("Refreshing cards.json from YGOPRODeck...")
+                refresh_card_catalog()
+        except Exception:
             logger.exception("Error during card update")
-        time.sleep(21600)  # Sleep 6 hours
+        time.sleep(CARD_REFRESH_INTERVAL if is_leader else CARD_WATCH_INTERVAL)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Database Initialisation
 # ----------------------------------------------------------------------------------------------------------------------
 DATABASE = 'shortener.db'
+# Caches shared by every worker (eBay prices, ...). WAL so readers never wait on the occasional writer.
+CACHE_DATABASE = os.getenv('CACHE_DATABASE', 'cache.db')
 
 
 def get_db():
@@ -134,6 +766,13 @@ def get_db():
     return conn
 
 
+def get_cache_db():
+    conn = sqlite3.connect(CACHE_DATABASE, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
 def init_db():
     with get_db() as db:
         db.execute('''
@@ -145,7 +784,514 @@ def init_db():
         ''')
 
 
+def init_cache_db():
+    with get_cache_db() as db:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS ebay_price_cache (
+                query TEXT NOT NULL,
+                region TEXT NOT NULL,
+                results TEXT NOT NULL,
+                fetched REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (query, region)
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS ebay_price_cache_accessed ON ebay_price_cache (accessed)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS ebay_token (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                token TEXT NOT NULL,
+                expiry REAL NOT NULL
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                ready INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                finished REAL
+            )
+        ''')
+        if 'filename' not in {row['name'] for row in db.execute('PRAGMA table_info(jobs)')}:
+            db.execute('ALTER TABLE jobs ADD COLUMN filename TEXT')
+        db.execute('CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS job_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS card_price_snapshot (
+                card TEXT NOT NULL,
+                region TEXT NOT NULL,
+                setcodes TEXT NOT NULL,
+                price REAL NOT NULL,
+                url TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (card, region)
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS card_popularity (
+                card TEXT NOT NULL,
+                region TEXT NOT NULL,
+                hits INTEGER NOT NULL,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (card, region)
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS card_popularity_hits ON card_popularity (hits)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS exchange_rates (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                rates TEXT NOT NULL,
+                fetched REAL NOT NULL
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS conversion_cache (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS conversion_cache_last_used ON conversion_cache (last_used)')
+
+
 init_db()
+init_cache_db()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Server Threads
+# ----------------------------------------------------------------------------------------------------------------------
+# Each gunicorn worker serves SERVER_THREADS requests at once (its --threads, see the Dockerfile). Requests that hold
+# their thread for a long time - job event streams, audio streams and synchronous /api/convert calls - share
+# LONG_REQUEST_SLOTS, by default half the threads, so short requests always find a free thread. Past that they get
+# a 503. Raise both together; LONG_REQUEST_SLOTS must stay well below SERVER_THREADS.
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '16'))
+LONG_REQUEST_SLOTS = int(os.getenv('LONG_REQUEST_SLOTS', str(max(SERVER_THREADS // 2, 1))))
+LONG_REQUEST_RETRY_AFTER = 5
+long_request_slots = threading.BoundedSemaphore(LONG_REQUEST_SLOTS)
+
+
+def server_busy():
+    response = jsonify({'error': 'The server is busy, please try again shortly.'})
+    response.headers['Retry-After'] = str(LONG_REQUEST_RETRY_AFTER)
+    return response, 503
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Job Store
+# ----------------------------------------------------------------------------------------------------------------------
+# Background jobs (XLSX exports, ...) live in cache.db with their output files under JOB_FILES_DIR, so any worker can
+# answer /progress and /download and jobs survive restarts. A cleanup thread drops jobs older than JOB_TTL, keeps
+# finished files within JOB_MAX_BYTES (oldest first), and fails jobs whose worker stopped updating them.
+# Jobs can also append events (job_events), which job_event_stream pushes to the browser as Server-Sent Events.
+# Event streams don't poll the database themselves: they sleep on job_changes, which is signalled right away by job
+# updates made in this process and by a single poller thread for updates made by other workers. Each stream still
+# holds a server thread, so streams count against LONG_REQUEST_SLOTS.
+# Jobs running in this process are touched on every cleanup pass, so long conversions are never mistaken for stale.
+JOB_FILES_DIR = os.getenv('JOB_FILES_DIR', 'jobs')
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))
+JOB_MAX_BYTES = int(os.getenv('JOB_MAX_BYTES', str(256 * 1024 * 1024)))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '600'))
+JOB_CLEANUP_INTERVAL = 60
+JOB_EVENT_POLL_INTERVAL = float(os.getenv('JOB_EVENT_POLL_INTERVAL', '1'))
+SSE_HEARTBEAT_INTERVAL = 15
+JOB_FIELDS = ('progress', 'ready', 'error')
+os.makedirs(JOB_FILES_DIR, exist_ok=True)
+running_jobs = set()
+running_jobs_lock = threading.Lock()
+job_changes = threading.Condition()
+job_watch = {'version': 0, 'streams': 0, 'polling': False}
+
+
+def job_file_path(job_id):
+    return os.path.join(JOB_FILES_DIR, job_id)
+
+
+def create_job(kind, filename=None):
+    # filename is the download name; jobs without one use their endpoint's default
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    with get_cache_db() as db:
+        db.execute('INSERT INTO jobs (id, kind, filename, created, updated) VALUES (?, ?, ?, ?, ?)',
+                   (job_id, kind, filename, now, now))
+    with running_jobs_lock:
+        running_jobs.add(job_id)
+    return job_id
+
+
+def update_job(job_id, **fields):
+    assert fields and set(fields) <= set(JOB_FIELDS)
+    columns = ', '.join(f'{name} = ?' for name in fields)
+    with get_cache_db() as db:
+        db.execute(f'UPDATE jobs SET {columns}, updated = ? WHERE id = ?', (*fields.values(), time.time(), job_id))
+    notify_job_watchers()
+
+
+def get_job(job_id):
+    with get_cache_db() as db:
+        row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id or '',)).fetchone()
+    return dict(row) if row else None
+
+
+def job_temp_path(job_id):
+    return job_file_path(job_id) + '.tmp'
+
+
+def finish_job(job_id):
+    # Jobs write their output to job_temp_path; renaming it into place means a download never sees a partial file
+    path = job_file_path(job_id)
+    os.replace(job_temp_path(job_id), path)
+    now = time.time()
+    with get_cache_db() as db:
+        db.execute('UPDATE jobs SET progress = 100, ready = 1, size = ?, updated = ?, finished = ? WHERE id = ?',
+                   (os.path.getsize(path), now, now, job_id))
+    notify_job_watchers()
+    with running_jobs_lock:
+        running_jobs.discard(job_id)
+
+
+def fail_job(job_id, error):
+    update_job(job_id, progress=100, ready=1, error=error)
+    with running_jobs_lock:
+        running_jobs.discard(job_id)
+
+
+def delete_job(job_id):
+    with get_cache_db() as db:
+        db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        db.execute('DELETE FROM job_events WHERE job_id = ?', (job_id,))
+    with running_jobs_lock:
+        running_jobs.discard(job_id)
+    remove_job_files([job_id])
+
+
+def add_job_event(job_id, event, data, progress=None):
+    with get_cache_db() as db:
+        db.execute('INSERT INTO job_events (job_id, event, data) VALUES (?, ?, ?)', (job_id, event, json.dumps(data)))
+        if progress is None:
+            db.execute('UPDATE jobs SET updated = ? WHERE id = ?', (time.time(), job_id))
+        else:
+            db.execute('UPDATE jobs SET progress = ?, updated = ? WHERE id = ?', (progress, time.time(), job_id))
+    notify_job_watchers()
+
+
+def notify_job_watchers():
+    with job_changes:
+        job_watch['version'] += 1
+        job_changes.notify_all()
+
+
+def poll_job_changes():
+    # The one thread per process that watches cache.db for job changes made by other workers; it exits when the last
+    # event stream closes and is restarted by the next one
+    last = None
+    while True:
+        try:
+            with get_cache_db() as db:
+                marker = tuple(db.execute('SELECT (SELECT MAX(seq) FROM job_events), (SELECT MAX(updated) FROM jobs)')
+                               .fetchone())
+        except Exception:
+            logger.exception("Failed to poll for job changes")
+            marker = last
+        with job_changes:
+            if last is not None and marker != last:
+                job_watch['version'] += 1
+                job_changes.notify_all()
+            last = marker
+            if not job_watch['streams']:
+                job_watch['polling'] = False
+                return
+        time.sleep(JOB_EVENT_POLL_INTERVAL)
+
+
+def watch_job_changes():
+    with job_changes:
+        job_watch['streams'] += 1
+        if not job_watch['polling']:
+            job_watch['polling'] = True
+            threading.Thread(target=poll_job_changes, daemon=True).start()
+        return job_watch['version']
+
+
+def unwatch_job_changes():
+    with job_changes:
+        job_watch['streams'] -= 1
+
+
+def wait_for_job_change(version, timeout):
+    # Returns the new version, or the same one if nothing changed within timeout
+    with job_changes:
+        job_changes.wait_for(lambda: job_watch['version'] != version, max(timeout, 0))
+        return job_watch['version']
+
+
+def sse_message(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {data}\n\n"
+
+
+def job_event_stream(job_id, last_seq, download_url):
+    # Runs for the life of one SSE connection: replays events after last_seq (EventSource sends Last-Event-ID when it
+    # reconnects), then follows the job until it finishes with a "ready" or "error" event
+    sent_progress = -1
+    last_write = time.monotonic()
+    version = watch_job_changes()
+    try:
+        while True:
+            job = get_job(job_id)
+            if not job:
+                yield sse_message('error', json.dumps({'error': 'Job not found'}))
+                return
+            with get_cache_db() as db:
+                rows = db.execute('SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq',
+                                  (job_id, last_seq)).fetchall()
+            for row in rows:
+                last_seq = row['seq']
+                sent_progress = max(sent_progress, json.loads(row['data']).get('progress', -1))
+                yield sse_message(row['event'], row['data'], row['seq'])
+            if job['ready']:
+                if job['error']:
+                    yield sse_message('error', json.dumps({'error': job['error']}))
+                else:
+                    yield sse_message('ready', json.dumps({'progress': 100, 'download_url': download_url}))
+                return
+            wrote = bool(rows)
+            if job['progress'] > sent_progress:
+                sent_progress = job['progress']
+                yield sse_message('progress', json.dumps({'progress': sent_progress}))
+                wrote = True
+            if wrote:
+                last_write = time.monotonic()
+            changed = wait_for_job_change(version, SSE_HEARTBEAT_INTERVAL - (time.monotonic() - last_write))
+            if changed == version:
+                # Comment line, keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                last_write = time.monotonic()
+            version = changed
+    finally:
+        unwatch_job_changes()
+
+
+def job_events_response(job_id, download_url):
+    if not long_request_slots.acquire(blocking=False):
+        return server_busy()
+    last_seq = request.headers.get('Last-Event-ID', '0')
+    last_seq = int(last_seq) if last_seq.isdigit() else 0
+    response = Response(job_event_stream(job_id, last_seq, download_url), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(long_request_slots.release)
+    return response
+
+
+def remove_job_files(job_ids):
+    for job_id in job_ids:
+        for path in (job_file_path(job_id), job_temp_path(job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cleanup_jobs():
+    now = time.time()
+    with running_jobs_lock:
+        alive = [(now, job_id) for job_id in running_jobs]
+    with get_cache_db() as db:
+        db.executemany('UPDATE jobs SET updated = ? WHERE id = ?', alive)
+        expired = [row['id'] for row in db.execute('SELECT id FROM jobs WHERE created < ?', (now - JOB_TTL,))]
+        db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        db.execute('UPDATE jobs SET ready = 1, progress = 100, error = ?, updated = ? WHERE ready = 0 AND updated < ?',
+                   ("Job was interrupted, please try again.", now, now - JOB_STALE_AFTER))
+        # Over the byte budget: drop the oldest finished outputs first
+        over_budget = []
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM jobs').fetchone()[0]
+        if total > JOB_MAX_BYTES:
+            for row in db.execute('SELECT id, size FROM jobs WHERE size > 0 ORDER BY finished'):
+                if total <= JOB_MAX_BYTES:
+                    break
+                over_budget.append(row['id'])
+                total -= row['size']
+            db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in over_budget])
+        db.execute('DELETE FROM job_events WHERE job_id NOT IN (SELECT id FROM jobs)')
+        known = {row['id'] for row in db.execute('SELECT id FROM jobs')}
+    remove_job_files(expired + over_budget)
+
+    # Files left behind by jobs that no longer exist (e.g. a crash between writing and recording)
+    for name in os.listdir(JOB_FILES_DIR):
+        path = os.path.join(JOB_FILES_DIR, name)
+        job_id = name[:-len('.tmp')] if name.endswith('.tmp') else name
+        try:
+            if job_id not in known and now - os.path.getmtime(path) > JOB_STALE_AFTER:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(expired), len(over_budget)
+
+
+def cleanup_jobs_periodically():
+    while True:
+        try:
+            expired, evicted = cleanup_jobs()
+            if expired or evicted:
+                logger.info("Job cleanup: %d expired, %d evicted over the byte budget", expired, evicted)
+        except Exception:
+            logger.exception("Job cleanup failed")
+        time.sleep(JOB_CLEANUP_INTERVAL)
+
+
+def job_store_summary():
+    with get_cache_db() as db:
+        row = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(ready = 0), 0) FROM jobs').fetchone()
+    return {'jobs': row[0], 'running': row[2], 'bytes': row[1], 'max_bytes': JOB_MAX_BYTES}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Scratch Space
+# ----------------------------------------------------------------------------------------------------------------------
+# Working files (uploaded inputs, intermediate outputs) live in one directory per request under SCRATCH_DIR instead of
+# loose temp files, so releasing a request's scratch is a single rmtree whatever it wrote. Directories in use by this
+# process are touched on every sweep; anything older than SCRATCH_STALE_AFTER was left by a crashed or killed worker
+# and is removed. New work is turned away up front when it would push scratch usage past SCRATCH_MAX_BYTES or leave
+# less than SCRATCH_MIN_FREE_BYTES free on the disk.
+# Usage is a running byte count (reservations added on open, directory sizes taken off on release) rather than a walk
+# of SCRATCH_DIR per request; the sweeper rescans the whole directory, which also picks up other workers' files.
+SCRATCH_DIR = os.getenv('SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'nephbox-scratch'))
+SCRATCH_MAX_BYTES = int(os.getenv('SCRATCH_MAX_BYTES', str(4 * 1024 * 1024 * 1024)))
+SCRATCH_MIN_FREE_BYTES = int(os.getenv('SCRATCH_MIN_FREE_BYTES', str(1024 * 1024 * 1024)))
+SCRATCH_STALE_AFTER = 900
+SCRATCH_SWEEP_INTERVAL = 120
+SCRATCH_RETRY_AFTER = 60
+os.makedirs(SCRATCH_DIR, exist_ok=True)
+active_scratch = set()
+scratch_lock = threading.Lock()
+scratch_stats = {'opened': 0, 'released': 0, 'rejected': 0, 'swept': 0}
+
+
+class ScratchSpaceFull(Exception):
+    pass
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+scratch_usage = {'bytes': directory_size(SCRATCH_DIR)}
+
+
+def open_scratch(expected_bytes=0):
+    # expected_bytes is what the caller is about to write (e.g. the upload's Content-Length)
+    reason = None
+    if shutil.disk_usage(SCRATCH_DIR).free - expected_bytes < SCRATCH_MIN_FREE_BYTES:
+        reason = 'Not enough free disk space'
+    else:
+        with scratch_lock:
+            if scratch_usage['bytes'] + expected_bytes > SCRATCH_MAX_BYTES:
+                reason = 'Scratch space quota reached'
+            else:
+                scratch_usage['bytes'] += expected_bytes
+    if reason:
+        with scratch_lock:
+            scratch_stats['rejected'] += 1
+        logger.warning("Refused %d bytes of scratch space: %s", expected_bytes, reason)
+        raise ScratchSpaceFull(reason)
+    path = tempfile.mkdtemp(dir=SCRATCH_DIR)
+    with scratch_lock:
+        active_scratch.add(path)
+        scratch_stats['opened'] += 1
+    return path
+
+
+def release_scratch(path):
+    # Safe to call more than once
+    with scratch_lock:
+        if path not in active_scratch:
+            return
+        active_scratch.discard(path)
+        scratch_stats['released'] += 1
+    size = directory_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    with scratch_lock:
+        scratch_usage['bytes'] = max(scratch_usage['bytes'] - size, 0)
+
+
+def scratch_space_full(error):
+    response = jsonify({'error': f"{error}, please try again later."})
+    response.headers['Retry-After'] = str(SCRATCH_RETRY_AFTER)
+    return response, 507
+
+
+def sweep_scratch():
+    now = time.time()
+    with scratch_lock:
+        active = set(active_scratch)
+    for path in active:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+    swept = 0
+    for entry in os.scandir(SCRATCH_DIR):
+        try:
+            if entry.path not in active and now - entry.stat().st_mtime > SCRATCH_STALE_AFTER:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+                swept += 1
+        except FileNotFoundError:
+            pass
+    total = directory_size(SCRATCH_DIR)
+    with scratch_lock:
+        scratch_stats['swept'] += swept
+        scratch_usage['bytes'] = total
+    return swept
+
+
+def sweep_scratch_periodically():
+    while True:
+        try:
+            swept = sweep_scratch()
+            if swept:
+                logger.info("Scratch sweep removed %d stale entries", swept)
+        except Exception:
+            logger.exception("Scratch sweep failed")
+        time.sleep(SCRATCH_SWEEP_INTERVAL)
+
+
+def scratch_summary():
+    with scratch_lock:
+        summary = dict(scratch_stats, active=len(active_scratch), bytes=scratch_usage['bytes'])
+    summary.update({
+        'free_bytes': shutil.disk_usage(SCRATCH_DIR).free,
+        'max_bytes': SCRATCH_MAX_BYTES,
+        'min_free_bytes': SCRATCH_MIN_FREE_BYTES,
+    })
+    return summary
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -191,69 +1337,498 @@ def contact():
 # ----------------------------------------------------------------------------------------------------------------------
 # File Converter Endpoint
 # ----------------------------------------------------------------------------------------------------------------------
-@app.route('/api/convert', methods=['POST'])
-@limiter.limit('5 per minute') if USE_LIMITER else (lambda f: f)
-def convert_file():
-    logger.info("POST /api/convert")
+# Conversions (wkhtmltopdf, python-docx, ffmpeg) run as jobs in a process pool sized separately from the web workers,
+# so a long transcode never ties up a request thread. At most CONVERT_WORKERS run at once and up to
+# CONVERT_QUEUE_LIMIT more wait their turn; past that new conversions get a 429 until a slot frees up.
+# Pool workers are spawned and run the conversions from converter.py. When the app is started directly (python app.py)
+# they also re-import this file as __main__, which is why the background loops are only started from the main process
+# (see Start Server). Each worker keeps a warm wkhtmltopdf running for document -> PDF jobs (see converter.PdfRenderer).
+CONVERT_WORKERS = int(os.getenv('CONVERT_WORKERS', '2'))
+CONVERT_QUEUE_LIMIT = int(os.getenv('CONVERT_QUEUE_LIMIT', '8'))
+CONVERT_RETRY_AFTER = 10
+# Audio can also be streamed through ffmpeg directly (/api/convert/audio), at most CONVERT_AUDIO_STREAMS at a time
+# (and within LONG_REQUEST_SLOTS, like the synchronous /api/convert)
+CONVERT_AUDIO_STREAMS = int(os.getenv('CONVERT_AUDIO_STREAMS', '4'))
+AUDIO_STREAM_CHUNK = 64 * 1024
+convert_pool = None
+convert_lock = threading.Lock()
+convert_stats = {'pending': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'pool_restarts': 0,
+                 'streams': 0, 'streams_failed': 0, 'streamed_bytes_in': 0, 'streamed_bytes_out': 0,
+                 'pdf_warm': 0, 'pdf_oneshot': 0}
+# Recent run times per conversion kind (time in a pool worker, not counting the queue)
+convert_durations = {kind: deque(maxlen=200) for kind in ('pdf', 'txt', 'audio')}
+audio_stream_slots = threading.BoundedSemaphore(CONVERT_AUDIO_STREAMS)
+
+
+def get_convert_pool():
+    global convert_pool
+    with convert_lock:
+        if convert_pool is None:
+            convert_pool = ProcessPoolExecutor(max_workers=CONVERT_WORKERS, initializer=warm_up,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return convert_pool
+
+
+def reset_convert_pool(pool):
+    # A worker that dies mid-job (OOM, segfault in a codec) breaks the whole pool; start a fresh one on next submit
+    global convert_pool
+    with convert_lock:
+        if convert_pool is pool:
+            convert_pool = None
+            convert_stats['pool_restarts'] += 1
+    pool.shutdown(wait=False)
+
+
+# Conversion results are cached on disk by content: the key is the SHA-256 of the upload (hashed while it is copied
+# off the request), how it is converted (the same bytes render differently as .txt, .md or .html), the target format
+# and CONVERTER_VERSION. A repeat conversion is answered by hard-linking the
+# cached output into the job, without touching the pool. Least recently used outputs are evicted past
+# CONVERSION_CACHE_MAX_BYTES.
+CONVERSION_CACHE_DIR = 'conversion-cache'
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv('CONVERSION_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK = 1024 * 1024
+os.makedirs(CONVERSION_CACHE_DIR, exist_ok=True)
+conversion_cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'stored': 0, 'evicted': 0}
+
+
+def conversion_cache_key(digest, filename, target_format):
+    source = os.path.splitext(filename)[1].lstrip('.').lower()
+    return f"{digest}-{conversion_kind(filename, target_format)}-{source}-{target_format}-{CONVERTER_VERSION}"
+
+
+def conversion_cache_path(key):
+    return os.path.join(CONVERSION_CACHE_DIR, key)
+
+
+def save_upload(uploaded_file, path):
+    # Copies the upload to path in chunks, hashing as it goes; returns the hex digest
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        while True:
+            chunk = uploaded_file.stream.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    # Hard link when possible (same filesystem, no copy); the two names then live and die independently
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def load_cached_conversion(key, target):
+    # Places the cached output for key at target; False on a miss
+    with get_cache_db() as db:
+        row = db.execute('SELECT size FROM conversion_cache WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return False
+        try:
+            link_or_copy(conversion_cache_path(key), target)
+        except FileNotFoundError:
+            db.execute('DELETE FROM conversion_cache WHERE key = ?', (key,))
+            return False
+        db.execute('UPDATE conversion_cache SET last_used = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+    with convert_lock:
+        conversion_cache_stats['hits'] += 1
+        conversion_cache_stats['bytes_saved'] += row['size']
+    return True
+
+
+def store_cached_conversion(key, source):
+    path = conversion_cache_path(key)
+    if not os.path.exists(path):
+        link_or_copy(source, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    now = time.time()
+    with get_cache_db() as db:
+        db.execute('INSERT OR REPLACE INTO conversion_cache (key, size, created, last_used) VALUES (?, ?, ?, ?)',
+                   (key, os.path.getsize(path), now, now))
+    with convert_lock:
+        conversion_cache_stats['stored'] += 1
+    evict_cached_conversions()
+
+
+def evict_cached_conversions():
+    evicted = []
+    with get_cache_db() as db:
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM conversion_cache').fetchone()[0]
+        if total > CONVERSION_CACHE_MAX_BYTES:
+            for row in db.execute('SELECT key, size FROM conversion_cache ORDER BY last_used'):
+                if total <= CONVERSION_CACHE_MAX_BYTES:
+                    break
+                evicted.append(row['key'])
+                total -= row['size']
+            db.executemany('DELETE FROM conversion_cache WHERE key = ?', [(key,) for key in evicted])
+    for key in evicted:
+        try:
+            os.remove(conversion_cache_path(key))
+        except FileNotFoundError:
+            pass
+    if evicted:
+        with convert_lock:
+            conversion_cache_stats['evicted'] += len(evicted)
+
+
+def conversion_cache_summary():
+    with get_cache_db() as db:
+        row = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM conversion_cache').fetchone()
+    with convert_lock:
+        summary = dict(conversion_cache_stats)
+    lookups = summary['hits'] + summary['misses']
+    summary.update({
+        'hit_rate': round(summary['hits'] / lookups, 3) if lookups else None,
+        'entries': row[0],
+        'bytes': row[1],
+        'max_bytes': CONVERSION_CACHE_MAX_BYTES,
+    })
+    return summary
+
+
+def start_conversion(scratch, uploaded_file, filename, target_format):
+    # Returns (job_id, done) where done resolves once the job is finished or failed, or None when the queue is full.
+    # Takes over the scratch directory and releases it once the conversion is over.
+    base_name = os.path.splitext(os.path.basename(filename))[0] or 'converted'
+    input_path = os.path.join(scratch, 'input' + os.path.splitext(filename)[1])
+    try:
+        key = conversion_cache_key(save_upload(uploaded_file, input_path), filename, target_format)
+    except Exception:
+        release_scratch(scratch)
+        raise
 
+    # Seen this exact input before: the job is done as soon as the cached output is linked in. The cache and the job
+    # files are both under the working directory (scratch may be on another filesystem), so that's a hard link.
+    job_id = create_job('convert', f"{base_name}.{target_format}")
+    done = Future()
+    try:
+        hit = load_cached_conversion(key, job_temp_path(job_id))
+        if hit:
+            finish_job(job_id)
+    except Exception:
+        logger.exception("Failed to serve %s from the conversion cache (job %s)", filename, job_id)
+        release_scratch(scratch)
+        fail_job(job_id, 'Conversion failed')
+        done.set_result(None)
+        return job_id, done
+    if hit:
+        release_scratch(scratch)
+        logger.info("Served %s to %s from the conversion cache (job %s)", filename, target_format, job_id)
+        done.set_result(None)
+        return job_id, done
+
+    with convert_lock:
+        conversion_cache_stats['misses'] += 1
+        full = convert_stats['pending'] >= CONVERT_WORKERS + CONVERT_QUEUE_LIMIT
+        convert_stats['rejected' if full else 'pending'] += 1
+    if full:
+        release_scratch(scratch)
+        delete_job(job_id)
+        return None
+
+    try:
+        pool = get_convert_pool()
+        future = pool.submit(run_conversion, input_path, filename, target_format, job_temp_path(job_id))
+    except Exception:
+        logger.exception("Failed to queue conversion %s", job_id)
+        release_scratch(scratch)
+        with convert_lock:
+            convert_stats['pending'] -= 1
+            convert_stats['failed'] += 1
+        fail_job(job_id, 'Conversion failed')
+        done.set_result(None)
+        return job_id, done
+
+    def on_done(future):
+        release_scratch(scratch)
+        error = future.exception()
+        if error is None:
+            try:
+                finish_job(job_id)
+                result = future.result()
+                logger.info("Converted %s to %s in %.2fs (job %s)", filename, target_format, result['seconds'], job_id)
+                with convert_lock:
+                    convert_durations[result['kind']].append(result['seconds'])
+                    if result['renderer']:
+                        convert_stats[f"pdf_{result['renderer']}"] += 1
+            except Exception as e:
+                error = e
+        if error is not None:
+            logger.error("File conversion failed (job %s): %r", job_id, error)
+            if isinstance(error, BrokenProcessPool):
+                reset_convert_pool(pool)
+            fail_job(job_id, 'Conversion failed')
+        with convert_lock:
+            convert_stats['pending'] -= 1
+            convert_stats['completed' if error is None else 'failed'] += 1
+        # Cached before anyone is told the job is done, since /api/convert deletes the job file once it's sent
+        if error is None:
+            try:
+                store_cached_conversion(key, job_file_path(job_id))
+            except Exception:
+                logger.exception("Failed to cache conversion %s", key)
+        done.set_result(None)
+
+    future.add_done_callback(on_done)
+    return job_id, done
+
+
+def read_conversion_request():
+    # Returns (file, filename, format) or an error response
     if 'file' not in request.files or 'format' not in request.form:
-        return jsonify({'error': 'Missing file or format'}), 400
+        return None, (jsonify({'error': 'Missing file or format'}), 400)
 
     target_format = request.form['format'].lower()
     uploaded_file = request.files['file']
     filename = uploaded_file.filename.lower()
 
     if not filename:
-        return jsonify({'error': 'Invalid file'}), 400
+        return None, (jsonify({'error': 'Invalid file'}), 400)
+    if not conversion_kind(filename, target_format):
+        return None, (jsonify({'error': 'Unsupported file or conversion type'}), 400)
+    return (uploaded_file, filename, target_format), None
+
+
+def conversion_queue_full():
+    response = jsonify({'error': 'The converter is busy, please try again shortly.'})
+    response.headers['Retry-After'] = str(CONVERT_RETRY_AFTER)
+    return response, 429
+
+
+def converter_summary():
+    with convert_lock:
+        summary = dict(convert_stats)
+        durations = {kind: sorted(times) for kind, times in convert_durations.items() if times}
+    summary.update({'workers': CONVERT_WORKERS, 'queue_limit': CONVERT_QUEUE_LIMIT,
+                    'audio_stream_limit': CONVERT_AUDIO_STREAMS})
+    summary['p50_seconds'] = {kind: round(times[len(times) // 2], 3) for kind, times in durations.items()}
+    return summary
+
 
+@app.route('/api/convert/start', methods=['POST'])
+@limiter.limit('5 per minute') if USE_LIMITER else (lambda f: f)
+def convert_start():
+    logger.info("POST /api/convert/start")
+    # Checked before the upload is read, so a full disk turns the request away without spooling it first
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_in:
-            uploaded_file.save(temp_in.name)
-            input_path = temp_in.name
-
-        output_suffix = f".{target_format}"
-        output_path = tempfile.NamedTemporaryFile(delete=False, suffix=output_suffix).name
-
-        # Document → PDF
-        if filename.endswith(('.txt', '.md', '.html', '.docx')) and target_format == 'pdf':
-            if filename.endswith('.md') or filename.endswith('.txt'):
-                with open(input_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                html = markdown(text) if filename.endswith('.md') else f"<pre>{text}</pre>"
-            elif filename.endswith('.html'):
-                with open(input_path, 'r', encoding='utf-8') as f:
-                    html = f.read()
-            elif filename.endswith('.docx'):
-                doc = Document(input_path)
-                html = ''.join(f"<p>{para.text}</p>" for para in doc.paragraphs)
-
-            config = pdfkit.configuration(wkhtmltopdf='/usr/bin/wkhtmltopdf')
-            pdfkit.from_string(html, output_path, configuration=config)
-            logger.info("Converted document to PDF")
-
-        # DOCX → TXT
-        elif filename.endswith('.docx') and target_format == 'txt':
-            doc = Document(input_path)
-            with open(output_path, 'w', encoding='utf-8') as out:
-                for para in doc.paragraphs:
-                    out.write(para.text + '\n')
-            logger.info("Converted DOCX to TXT")
-
-        # Audio conversion
-        elif filename.endswith(('.mp3', '.wav', '.ogg')):
-            audio = AudioSegment.from_file(input_path)
-            audio.export(output_path, format=target_format)
-            logger.info("Converted audio to %s", target_format)
+        scratch = open_scratch(request.content_length or 0)
+    except ScratchSpaceFull as e:
+        return scratch_space_full(e)
+    conversion, error = read_conversion_request()
+    if error:
+        release_scratch(scratch)
+        return error
+    started = start_conversion(scratch, *conversion)
+    if not started:
+        return conversion_queue_full()
+    return jsonify({'job_id': started[0]}), 202
+
+
+@app.route('/api/convert/status')
+def convert_status():
+    job = get_job(request.args.get('job_id'))
+    if not job or job['kind'] != 'convert':
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'progress': job['progress'],
+        'ready': bool(job['ready']),
+        'error': job['error']
+    })
 
-        else:
-            return jsonify({'error': 'Unsupported file or conversion type'}), 400
 
-        return send_file(output_path, as_attachment=True)
+@app.route('/api/convert/events')
+def convert_events():
+    job_id = request.args.get('job_id')
+    job = get_job(job_id)
+    if not job or job['kind'] != 'convert':
+        return jsonify({'error': 'Job not found'}), 404
+    return job_events_response(job_id, f"/api/convert/download?job_id={job_id}")
+
 
+@app.route('/api/convert/download')
+def convert_download():
+    logger.info(f"GET /api/convert/download job_id={request.args.get('job_id')}")
+    job_id = request.args.get('job_id')
+    job = get_job(job_id)
+    if not job or job['kind'] != 'convert' or not job['ready'] or not job['size'] \
+            or not os.path.exists(job_file_path(job_id)):
+        return jsonify({'error': 'Not ready'}), 400
+    return send_file(os.path.abspath(job_file_path(job_id)), as_attachment=True, download_name=job['filename'])
+
+
+def convert_download_response(job_id):
+    # Nobody can ask for a one-shot conversion again, so its job goes right away. The output is sent from a handle
+    # opened first, which keeps the data readable after the file is removed. (send_file responses are passed through
+    # as-is, so call_on_close callbacks would never run for them.)
+    job = get_job(job_id)
+    if not job or job['error']:
+        delete_job(job_id)
+        return jsonify({'error': 'Conversion failed'}), 500
+    output = open(job_file_path(job_id), 'rb')
+    delete_job(job_id)
+    response = send_file(output, as_attachment=True, download_name=job['filename'])
+    response.content_length = job['size']
+    return response
+
+
+@app.route('/api/convert', methods=['POST'])
+@limiter.limit('5 per minute') if USE_LIMITER else (lambda f: f)
+def convert_file():
+    # Original one-shot API, kept synchronous on purpose: its clients expect the converted file in the response, and
+    # changing that to a job id would break them. It queues the same job as /api/convert/start and waits for it, so
+    # the CPU-heavy work still runs in a pool worker and counts against CONVERT_QUEUE_LIMIT (a full queue is a 429,
+    # not a long wait); only an idle request thread is held. New clients (the site itself) use /api/convert/start.
+    logger.info("POST /api/convert")
+    if not long_request_slots.acquire(blocking=False):
+        return server_busy()
+    try:
+        try:
+            scratch = open_scratch(request.content_length or 0)
+        except ScratchSpaceFull as e:
+            return scratch_space_full(e)
+        conversion, error = read_conversion_request()
+        if error:
+            release_scratch(scratch)
+            return error
+        started = start_conversion(scratch, *conversion)
+        if not started:
+            return conversion_queue_full()
+        job_id, done = started
+        done.result()
+    finally:
+        long_request_slots.release()
+    return convert_download_response(job_id)
+
+
+def feed_ffmpeg(stream, process, state):
+    # Runs in its own thread: copies the request body into ffmpeg's stdin while the response reads its stdout
+    limit = MAX_FILE_SIZE_MB * 1024 * 1024
+    try:
+        while True:
+            chunk = stream.read(AUDIO_STREAM_CHUNK)
+            if not chunk:
+                break
+            state['bytes_in'] += len(chunk)
+            if state['bytes_in'] > limit:
+                state['error'] = 'File too large'
+                process.kill()
+                return
+            process.stdin.write(chunk)
+    except OSError:
+        # ffmpeg exited early (bad input) or the client went away; the exit code tells which
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+
+def drain_ffmpeg_errors(process, lines):
+    for line in process.stderr:
+        lines.append(line.decode(errors='replace').rstrip())
+
+
+def stream_ffmpeg_output(process, first_chunk, state, filename):
+    chunk = first_chunk
+    while chunk:
+        state['bytes_out'] += len(chunk)
+        yield chunk
+        chunk = process.stdout.read(AUDIO_STREAM_CHUNK)
+    process.wait()
+    if process.returncode or state['error']:
+        # Headers are already out, so all that's left is to cut the stream short and log why
+        state['failed'] = True
+        logger.error("Audio stream of %s failed: %s", filename, state['error'] or '; '.join(state['stderr']))
+
+
+def close_audio_stream(process, state):
+    # Runs when the response is closed: after the last chunk, or when the client went away before or during the
+    # download (in which case the generator may never have run at all)
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+        state['failed'] = True
+    finish_audio_stream(state)
+
+
+def finish_audio_stream(state):
+    with convert_lock:
+        convert_stats['streamed_bytes_in'] += state['bytes_in']
+        convert_stats['streamed_bytes_out'] += state['bytes_out']
+        if state['failed']:
+            convert_stats['streams_failed'] += 1
+    audio_stream_slots.release()
+    long_request_slots.release()
+
+
+@app.route('/api/convert/audio', methods=['POST'])
+@limiter.limit('5 per minute') if USE_LIMITER else (lambda f: f)
+def convert_audio_stream():
+    # Raw request body in (not multipart, so nothing is spooled to disk), transcoded by ffmpeg stdin -> stdout and
+    # streamed back chunk by chunk. Memory stays flat whatever the file size.
+    # e.g. curl --data-binary @song.wav -o song.mp3 '/api/convert/audio?name=song.wav&format=mp3'
+    # The client must read the response while it is still uploading (curl does, as does a proxy that buffers uploads).
+    filename = os.path.basename(request.args.get('name', '').lower())
+    target_format = request.args.get('format', '').lower()
+    logger.info("POST /api/convert/audio name=%s format=%s", filename, target_format)
+    if conversion_kind(filename, target_format) != 'audio':
+        return jsonify({'error': 'Unsupported file or conversion type'}), 400
+    if (request.content_length or 0) > MAX_FILE_SIZE_MB * 1024 * 1024:
+        return jsonify({'error': 'File too large'}), 413
+    if not audio_stream_slots.acquire(blocking=False):
+        with convert_lock:
+            convert_stats['rejected'] += 1
+        return conversion_queue_full()
+    if not long_request_slots.acquire(blocking=False):
+        audio_stream_slots.release()
+        return server_busy()
+
+    state = {'bytes_in': 0, 'bytes_out': 0, 'error': None, 'failed': False, 'stderr': deque(maxlen=20)}
+    with convert_lock:
+        convert_stats['streams'] += 1
+    try:
+        process = subprocess.Popen(ffmpeg_command(filename, target_format), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        logger.exception("Failed to start ffmpeg")
+        state['failed'] = True
+        finish_audio_stream(state)
+        return jsonify({'error': 'Conversion failed'}), 500
+    threading.Thread(target=feed_ffmpeg, args=(request.stream, process, state), daemon=True).start()
+    errors = threading.Thread(target=drain_ffmpeg_errors, args=(process, state['stderr']), daemon=True)
+    errors.start()
+
+    # Wait for the first output before committing to a 200, so input ffmpeg can't read still gets a proper error
+    try:
+        first_chunk = process.stdout.read(AUDIO_STREAM_CHUNK)
     except Exception:
-        logger.exception("File conversion failed")
+        close_audio_stream(process, state)
+        raise
+    if not first_chunk:
+        process.wait()
+        errors.join(1)
+        state['failed'] = True
+        logger.error("Audio stream of %s failed: %s", filename, state['error'] or '; '.join(state['stderr']))
+        finish_audio_stream(state)
+        if state['error']:
+            return jsonify({'error': state['error']}), 413
         return jsonify({'error': 'Conversion failed'}), 500
 
+    base_name = re.sub(r'[^\w.-]', '_', os.path.splitext(filename)[0]) or 'converted'
+    response = Response(stream_ffmpeg_output(process, first_chunk, state, filename), mimetype=f"audio/{target_format}",
+                        headers={
+                            'Content-Disposition': f'attachment; filename="{base_name}.{target_format}"',
+                            'X-Accel-Buffering': 'no',
+                        })
+    # The stream slot and ffmpeg are released here rather than in the generator, which never runs if the client
+    # disconnects before the first chunk is sent
+    response.call_on_close(lambda: close_audio_stream(process, state))
+    return response
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 # JSON Validator Endpoint
@@ -434,7 +2009,8 @@ def chat():
         return jsonify({'error': 'Webhook URL not set'}), 500
 
     try:
-        resp = requests.post(
+        resp = http_request(
+            'POST',
             DISCORD_WEBHOOK_URL,
             json={"content": content}
         )
@@ -666,8 +2242,14 @@ def stripe_session_info():
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def get_ebay_prices(card_name, region='GB'):
-    url = "https://api.ebay.com/buy/browse/v1/item_summary/search"
+class EbayApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"eBay API error {status}: {message}")
+        self.status = status
+
+
+def fetch_ebay_prices(card_name, region='GB'):
+    url = f"{EBAY_API_BASE}/buy/browse/v1/item_summary/search"
     marketplace_id = 'EBAY_GB' if region == 'GB' else 'EBAY_US'
     params = {
         'q': card_name,
@@ -682,11 +2264,16 @@ def get_ebay_prices(card_name, region='GB'):
         'Content-Type': 'application/json',
         'X-EBAY-C-MARKETPLACE-ID': marketplace_id,
     }
-    response = requests.get(url, headers=headers, params=params)
+    ebay_scheduler.throttle()
+    response = http_request('GET', url, headers=headers, params=params)
+    ebay_scheduler.report(response.status_code)
+    # Errors are raised rather than returned as an empty list so they never end up in the price cache
+    if not response.ok:
+        raise EbayApiError(response.status_code, response.text[:200])
     try:
         data = response.json()
     except Exception:
-        return []
+        raise EbayApiError(response.status_code, "invalid JSON")
     results = []
     for item in data.get('itemSummaries', []):
         price = item.get('price', {})
@@ -700,15 +2287,588 @@ def get_ebay_prices(card_name, region='GB'):
     return results
 
 
-def get_ebay_access_token():
-    global ebay_access_token, ebay_token_expiry
+# eBay price cache: (query, region) -> results in cache.db, shared by all workers and kept across restarts.
+# Fresh for EBAY_CACHE_TTL; after that, entries younger than EBAY_CACHE_STALE_TTL are still served immediately while
+# a background thread refreshes them. Least recently used entries are evicted past EBAY_CACHE_MAX_ENTRIES.
+EBAY_CACHE_TTL = int(os.getenv('EBAY_CACHE_TTL', '3600'))
+EBAY_CACHE_STALE_TTL = int(os.getenv('EBAY_CACHE_STALE_TTL', '86400'))
+EBAY_CACHE_MAX_ENTRIES = int(os.getenv('EBAY_CACHE_MAX_ENTRIES', '20000'))
+EBAY_CACHE_TOUCH_INTERVAL = 60
+EBAY_CACHE_EVICT_EVERY = 50
+ebay_cache_stats = Counter()
+ebay_cache_lock = threading.Lock()
+ebay_cache_refreshing = set()
+
+
+def store_ebay_prices(card_name, region, results):
     now = time.time()
-    # If we have a token and it's not expiring in the next 2 minutes, use it
-    if ebay_access_token and now < ebay_token_expiry - 120:
-        return ebay_access_token
+    with get_cache_db() as db:
+        db.execute(
+            'INSERT OR REPLACE INTO ebay_price_cache (query, region, results, fetched, accessed) VALUES (?, ?, ?, ?, ?)',
+            (card_name, region, json.dumps(results), now, now)
+        )
+    with ebay_cache_lock:
+        ebay_cache_stats['writes'] += 1
+        evict = ebay_cache_stats['writes'] % EBAY_CACHE_EVICT_EVERY == 0
+    if evict:
+        with get_cache_db() as db:
+            db.execute('''
+                DELETE FROM ebay_price_cache WHERE rowid IN (
+                    SELECT rowid FROM ebay_price_cache ORDER BY accessed
+                    LIMIT max((SELECT COUNT(*) FROM ebay_price_cache) - ?, 0)
+                )
+            ''', (EBAY_CACHE_MAX_ENTRIES,))
+
+
+# Single-flight: concurrent callers asking for the same (query, region) wait on one in-flight request and share its
+# result (or its error) instead of each sending an identical call to eBay.
+ebay_inflight = {}
+ebay_inflight_lock = threading.Lock()
+ebay_flight_stats = Counter()
+
+
+def fetch_ebay_prices_once(card_name, region):
+    key = (card_name, region)
+    with ebay_inflight_lock:
+        future = ebay_inflight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = ebay_inflight[key] = Future()
+            ebay_flight_stats['requests'] += 1
+        else:
+            ebay_flight_stats['coalesced'] += 1
+    if not is_leader:
+        return future.result()
+
+    try:
+        results = fetch_ebay_prices(card_name, region=region)
+        store_ebay_prices(card_name, region, results)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(results)
+        return results
+    finally:
+        with ebay_inflight_lock:
+            ebay_inflight.pop(key, None)
+
+
+def ebay_flight_summary():
+    with ebay_inflight_lock:
+        return {'requests': ebay_flight_stats['requests'], 'coalesced': ebay_flight_stats['coalesced'],
+                'in_flight': len(ebay_inflight)}
+
+
+def refresh_ebay_prices(card_name, region):
+    try:
+        fetch_ebay_prices_once(card_name, region)
+    except Exception:
+        logger.exception("Background eBay refresh failed for %s (%s)", card_name, region)
+        with ebay_cache_lock:
+            ebay_cache_stats['errors'] += 1
+    finally:
+        with ebay_cache_lock:
+            ebay_cache_refreshing.discard((card_name, region))
+
+
+def cached_ebay_prices(card_name, region):
+    # Cached listings that are still servable (fresh or stale), never a live call
+    with get_cache_db() as db:
+        row = db.execute('SELECT results, fetched FROM ebay_price_cache WHERE query = ? AND region = ?',
+                         (card_name, region)).fetchone()
+    return json.loads(row['results']) if row and time.time() - row['fetched'] < EBAY_CACHE_STALE_TTL else []
+
+
+def get_ebay_prices(card_name, region='GB', raise_errors=False, fresh=False):
+    if fresh:
+        # Skip the cache entirely (the result still goes into it)
+        with ebay_cache_lock:
+            ebay_cache_stats['misses'] += 1
+        return fetch_ebay_prices_once(card_name, region)
+
+    now = time.time()
+    with get_cache_db() as db:
+        row = db.execute('SELECT results, fetched, accessed FROM ebay_price_cache WHERE query = ? AND region = ?',
+                         (card_name, region)).fetchone()
+        if row and now - row['accessed'] > EBAY_CACHE_TOUCH_INTERVAL:
+            db.execute('UPDATE ebay_price_cache SET accessed = ? WHERE query = ? AND region = ?',
+                       (now, card_name, region))
+
+    age = now - row['fetched'] if row else None
+    if row and age < EBAY_CACHE_TTL:
+        with ebay_cache_lock:
+            ebay_cache_stats['hits'] += 1
+        return json.loads(row['results'])
+
+    if row and age < EBAY_CACHE_STALE_TTL:
+        key = (card_name, region)
+        with ebay_cache_lock:
+            ebay_cache_stats['stale_hits'] += 1
+            start_refresh = key not in ebay_cache_refreshing
+            ebay_cache_refreshing.add(key)
+        if start_refresh:
+            threading.Thread(target=refresh_ebay_prices, args=key, daemon=True).start()
+        return json.loads(row['results'])
+
+    with ebay_cache_lock:
+        ebay_cache_stats['misses'] += 1
+    try:
+        return fetch_ebay_prices_once(card_name, region)
+    except Exception:
+        logger.exception("eBay lookup failed for %s (%s)", card_name, region)
+        with ebay_cache_lock:
+            ebay_cache_stats['errors'] += 1
+        # Callers that can retry (the lookup scheduler) get the error when there's nothing to fall back on
+        if raise_errors and not row:
+            raise
+        return json.loads(row['results']) if row else []
+
+
+def ebay_cache_summary():
+    with get_cache_db() as db:
+        entries = db.execute('SELECT COUNT(*) FROM ebay_price_cache').fetchone()[0]
+    with ebay_cache_lock:
+        stats = {key: ebay_cache_stats[key] for key in ('hits', 'stale_hits', 'misses', 'errors', 'writes')}
+    lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups, 3) if lookups else None
+    stats['entries'] = entries
+    return stats
+
+
+# Process-wide eBay lookup scheduler. Every XLSX job submits its lookups here instead of running its own thread pool:
+#  - at most `limit` lookups run at once; the limit grows by ~1 per window of successes and halves on a 429/5xx
+#    (AIMD), never exceeding EBAY_LOOKUP_WORKERS
+#  - every outbound search first takes a token from a bucket refilled at EBAY_RATE_PER_SECOND (set this to match the
+#    app's Browse API call limit), and after a 429 all calls pause for EBAY_BACKOFF_SECONDS
+#  - jobs are served round-robin, so a 150-card deck can't starve a 10-card one
+#  - lookups that fail with a 429/5xx are retried (EBAY_TASK_RETRIES) instead of silently pricing at 0.0
+EBAY_RATE_PER_SECOND = float(os.getenv('EBAY_RATE_PER_SECOND', '5'))
+EBAY_RATE_BURST = int(os.getenv('EBAY_RATE_BURST', '20'))
+EBAY_BACKOFF_SECONDS = float(os.getenv('EBAY_BACKOFF_SECONDS', '5'))
+EBAY_TASK_RETRIES = 3
+
+
+def is_retryable_ebay_error(e):
+    return isinstance(e, EbayApiError) and (e.status == 429 or e.status >= 500)
+
+
+class LookupScheduler:
+    def __init__(self, max_concurrency, rate, burst):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.active = 0
+        self.queues = OrderedDict()  # job_id -> deque of [future, fn, args, attempts]
+        self.cond = threading.Condition()
+        self.rate_lock = threading.Lock()
+        self.stats = Counter()
+        for _ in range(max_concurrency):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, job_id, fn, *args):
+        future = Future()
+        with self.cond:
+            self.queues.setdefault(job_id, deque()).append([future, fn, args, 0])
+            self.stats['submitted'] += 1
+            self.cond.notify()
+        return future
+
+    def _next_task(self):
+        # Round-robin: take one task from the job at the front, then move that job to the back
+        job_id, queue = next(iter(self.queues.items()))
+        task = queue.popleft()
+        if queue:
+            self.queues.move_to_end(job_id)
+        else:
+            del self.queues[job_id]
+        return job_id, task
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queues or self.active >= int(self.limit):
+                    self.cond.wait()
+                job_id, task = self._next_task()
+                self.active += 1
+            future, fn, args, attempts = task
+            try:
+                if not future.cancelled():
+                    future.set_result(fn(*args))
+                    self.stats['completed'] += 1
+            except Exception as e:
+                if is_retryable_ebay_error(e) and attempts < EBAY_TASK_RETRIES:
+                    task[3] += 1
+                    with self.cond:
+                        self.queues.setdefault(job_id, deque()).appendleft(task)
+                        self.stats['retried'] += 1
+                else:
+                    future.set_exception(e)
+                    self.stats['failed'] += 1
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.cond.notify_all()
+
+    def throttle(self):
+        # Called before every outbound eBay search: honour any 429 pause, then take a rate token
+        while True:
+            with self.rate_lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def report(self, status):
+        # AIMD feedback from every eBay response
+        with self.cond:
+            if status == 429 or status >= 500:
+                self.limit = max(1.0, self.limit / 2)
+                self.stats['backoffs'] += 1
+                if status == 429:
+                    self.stats['rate_limited'] += 1
+                    with self.rate_lock:
+                        self.paused_until = time.monotonic() + EBAY_BACKOFF_SECONDS
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self.cond.notify_all()
+
+    def summary(self):
+        with self.cond:
+            stats = {key: self.stats[key] for key in
+                     ('submitted', 'completed', 'retried', 'failed', 'backoffs', 'rate_limited')}
+            stats.update({
+                'limit': round(self.limit, 2),
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'queued': sum(len(queue) for queue in self.queues.values()),
+                'jobs': len(self.queues),
+            })
+        return stats
+
+
+ebay_scheduler = LookupScheduler(EBAY_LOOKUP_WORKERS, EBAY_RATE_PER_SECOND, EBAY_RATE_BURST)
+
+
+# Deck pricing. Each card's EN printings are planned into a few queries before anything is sent:
+#  - printings are capped at EBAY_MAX_PRINTINGS, cheapest rarities first (they carry the lowest listings)
+#  - up to EBAY_SETCODES_PER_QUERY setcodes are merged into one OR query, "(MP23-EN001, RA01-EN001) Card Name"
+#  - a card's queries run one after another and stop once a listing at or under EBAY_PRICE_CUTOFF is found
+# The first query of every card in the deck is submitted to the scheduler up front, so a deck costs a few round trips
+# instead of one per printing. Cards whose setcodes found nothing fall back to a name-only search.
+EBAY_MAX_PRINTINGS = int(os.getenv('EBAY_MAX_PRINTINGS', '8'))
+EBAY_SETCODES_PER_QUERY = int(os.getenv('EBAY_SETCODES_PER_QUERY', '4'))
+EBAY_PRICE_CUTOFF = float(os.getenv('EBAY_PRICE_CUTOFF', '1.0'))
+RARITY_ORDER = ['common', 'short print', 'rare', 'super rare', 'ultra rare', 'secret rare']
+ebay_planner_stats = Counter()
+ebay_planner_lock = threading.Lock()
+
+
+def ebay_price_value(listing, currency=None):
+    # Listing prices look like "3.35 GBP"; with a target currency, other currencies are converted at the current rate
+    try:
+        parts = listing['price'].replace('£', '').replace('$', '').split()
+        value = float(parts[0])
+    except Exception:
+        return float('inf')
+    if currency and len(parts) > 1:
+        value = convert_price(value, parts[1].upper(), currency)
+    return value if value is not None else float('inf')
+
+
+def cheapest_listing(results, currency=None):
+    priced = [x for x in results if x['price'] != "N/A"]
+    if not priced:
+        return None
+    prices = [ebay_price_value(x, currency) for x in priced]
+    best = min(range(len(priced)), key=prices.__getitem__)
+    if prices[best] == float('inf'):
+        return None
+    return prices[best], priced[best]['url']
+
+
+def rarity_rank(card_set):
+    rarity = (card_set.get('set_rarity') or '').lower()
+    return RARITY_ORDER.index(rarity) if rarity in RARITY_ORDER else len(RARITY_ORDER)
+
+
+def plan_ebay_queries(card_name, card_sets):
+    en_sets = [s for s in card_sets if 'EN' in s.get('set_code', '')]
+    setcodes = list(dict.fromkeys(s['set_code'] for s in en_sets))
+    if not setcodes:
+        return setcodes, [card_name]
+    # sorted() is stable, so printings of the same rarity keep their card_sets order
+    ranked = list(dict.fromkeys(s['set_code'] for s in sorted(en_sets, key=rarity_rank)))[:EBAY_MAX_PRINTINGS]
+    queries = []
+    for i in range(0, len(ranked), EBAY_SETCODES_PER_QUERY):
+        batch = ranked[i:i + EBAY_SETCODES_PER_QUERY]
+        queries.append(f"{batch[0]} {card_name}" if len(batch) == 1 else f"({', '.join(batch)}) {card_name}")
+    return setcodes, queries
+
+
+def price_deck(job_id, card_sets, region, on_card=None, fresh=False):
+    pending = {}  # future -> card name
+    plans = {}
+    best = {}
+    calls = Counter()
+    fell_back = set()
+    prices = {}
+
+    def submit(card_name, query):
+        calls[card_name] += 1
+        pending[ebay_scheduler.submit(job_id, get_ebay_prices, query, region, True, fresh)] = card_name
+
+    for card_name, sets in card_sets.items():
+        setcodes, queries = plan_ebay_queries(card_name, sets)
+        plans[card_name] = (setcodes, deque(queries))
+        submit(card_name, plans[card_name][1].popleft())
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            card_name = pending.pop(future)
+            setcodes, queries = plans[card_name]
+            try:
+                listing = cheapest_listing(future.result(), region_currency(region))
+            except Exception:
+                logger.exception("Failed to fetch price for %s", card_name)
+                listing = None
+            if listing and (card_name not in best or listing[0] < best[card_name][0]):
+                best[card_name] = listing
+            found_cheap = card_name in best and best[card_name][0] <= EBAY_PRICE_CUTOFF
+            if queries and not found_cheap:
+                submit(card_name, queries.popleft())
+                continue
+            # If no EN setcode found a price, fall back to the card name
+            if card_name not in best and setcodes and card_name not in fell_back:
+                fell_back.add(card_name)
+                submit(card_name, card_name)
+                continue
+            best_price, best_url = best.get(card_name, (0.0, ""))
+            prices[card_name] = (", ".join(setcodes), best_price, best_url)
+            if on_card:
+                on_card(card_name, prices[card_name])
+
+    # Unplanned cost: one search per EN setcode, plus the name fallback when none of them found a price
+    naive = sum(len(setcodes) or 1 for setcodes, _ in plans.values()) + len(fell_back)
+    with ebay_planner_lock:
+        ebay_planner_stats['cards'] += len(plans)
+        ebay_planner_stats['queries'] += sum(calls.values())
+        ebay_planner_stats['unplanned_queries'] += naive
+    for card_name, count in calls.most_common():
+        logger.debug("eBay queries for %s: %d", card_name, count)
+    logger.info("Priced %d cards with %d eBay queries (%d without planning)", len(plans), sum(calls.values()), naive)
+    return prices
+
+
+def ebay_planner_summary():
+    with ebay_planner_lock:
+        stats = {key: ebay_planner_stats[key] for key in ('cards', 'queries', 'unplanned_queries')}
+    stats['queries_per_card'] = round(stats['queries'] / stats['cards'], 2) if stats['cards'] else None
+    return stats
+
+
+# Card price snapshots: the cheapest eBay listing per (card, region) from the last planned pricing, kept in cache.db.
+# Deck exports answer from a snapshot younger than PRICE_SNAPSHOT_TTL instead of calling eBay (unless fresh is asked
+# for), and every live pricing writes its results back. Demand per card is counted in card_popularity; a background
+# indexer (one worker per host, via a file lock) re-prices the most requested cards before their snapshots go stale.
+# A card with no snapshot for the requested region can use the other region's, converted at the current exchange
+# rate. When eBay has nothing for a card, YGOPRODeck's card_prices (USD, converted) is the fallback.
+PRICE_SNAPSHOT_TTL = int(os.getenv('PRICE_SNAPSHOT_TTL', str(6 * 3600)))
+PRICE_INDEX_INTERVAL = int(os.getenv('PRICE_INDEX_INTERVAL', '300'))
+PRICE_INDEX_TOP = int(os.getenv('PRICE_INDEX_TOP', '500'))
+PRICE_INDEX_BATCH = int(os.getenv('PRICE_INDEX_BATCH', '100'))
+PRICE_POPULARITY_WINDOW = 7 * 86400
+PRICE_FALLBACK_KEYS = ('ebay_price', 'tcgplayer_price')
+price_snapshot_stats = Counter()
+price_snapshot_lock = threading.Lock()
+
+
+def region_currency(region):
+    return 'USD' if region == 'US' else 'GBP'
+
+
+def record_card_demand(names, region):
+    now = time.time()
+    with get_cache_db() as db:
+        db.executemany('''
+            INSERT INTO card_popularity (card, region, hits, last_seen) VALUES (?, ?, ?, ?)
+            ON CONFLICT (card, region) DO UPDATE SET hits = hits + excluded.hits, last_seen = excluded.last_seen
+        ''', [(name, region, count, now) for name, count in Counter(names).items()])
+
+
+def load_price_snapshots(names, region):
+    names = list(dict.fromkeys(names))
+    snapshots = {}
+    with get_cache_db() as db:
+        for i in range(0, len(names), CATALOG_QUERY_CHUNK):
+            chunk = names[i:i + CATALOG_QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = db.execute(
+                f'SELECT * FROM card_price_snapshot WHERE region = ? AND updated > ? AND card IN ({placeholders})',
+                (region, time.time() - PRICE_SNAPSHOT_TTL, *chunk)
+            )
+            snapshots.update((row['card'], dict(row)) for row in rows)
+    return snapshots
+
+
+def store_price_snapshots(prices, region):
+    # prices: {card name: (setcodes, price, url)}
+    now = time.time()
+    with get_cache_db() as db:
+        db.executemany(
+            'INSERT OR REPLACE INTO card_price_snapshot (card, region, setcodes, price, url, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(name, region, setcodes, price, url, now) for name, (setcodes, price, url) in prices.items()]
+        )
 
-    # Else, refresh the token
-    import requests, base64
+
+def ygoprodeck_price(card, region):
+    # card_prices is in USD
+    for key in PRICE_FALLBACK_KEYS:
+        try:
+            price = float((card.get('card_prices') or [{}])[0].get(key) or 0)
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if price > 0:
+            price = convert_price(price, 'USD', region_currency(region))
+            return (round(price, 2), card.get('ygoprodeck_url', '')) if price is not None else None
+    return None
+
+
+def price_cards(job_id, cards, region, on_card=None, fresh=False):
+    # cards: {name: card with card_sets / card_prices}. Snapshot hits are reported straight away; the rest are priced
+    # live, written back as snapshots, and fall back to card_prices when eBay found nothing.
+    snapshots = {} if fresh else load_price_snapshots(cards, region)
+    converted = 0
+    if not fresh and len(snapshots) < len(cards):
+        other = 'US' if region == 'GB' else 'GB'
+        missing = [name for name in cards if name not in snapshots]
+        for name, snapshot in load_price_snapshots(missing, other).items():
+            price = convert_price(snapshot['price'], region_currency(other), region_currency(region))
+            if price is not None:
+                snapshots[name] = {**snapshot, 'price': round(price, 2)}
+                converted += 1
+    prices = {}
+    live_prices = {}
+    fallbacks = 0
+    for name, snapshot in snapshots.items():
+        prices[name] = (snapshot['setcodes'], snapshot['price'], snapshot['url'])
+        if on_card:
+            on_card(name, prices[name])
+
+    def priced(name, result):
+        nonlocal fallbacks
+        if result[1]:
+            live_prices[name] = result
+        else:
+            fallback = ygoprodeck_price(cards[name], region)
+            if fallback:
+                result = (result[0], *fallback)
+                fallbacks += 1
+        prices[name] = result
+        if on_card:
+            on_card(name, result)
+
+    live = {name: card.get('card_sets') or [] for name, card in cards.items() if name not in snapshots}
+    if live:
+        price_deck(job_id, live, region, on_card=priced, fresh=fresh)
+        store_price_snapshots(live_prices, region)
+    with price_snapshot_lock:
+        price_snapshot_stats['snapshot_hits'] += len(snapshots)
+        price_snapshot_stats['converted'] += converted
+        price_snapshot_stats['live'] += len(live)
+        price_snapshot_stats['fallbacks'] += fallbacks
+    return prices
+
+
+def index_card_prices():
+    # One pass: re-price the most requested cards whose snapshots are missing or past half their TTL
+    now = time.time()
+    with get_cache_db() as db:
+        rows = db.execute('''
+            SELECT p.card, p.region FROM (
+                SELECT card, region, hits FROM card_popularity WHERE last_seen > ? ORDER BY hits DESC LIMIT ?
+            ) p
+            LEFT JOIN card_price_snapshot s ON s.card = p.card AND s.region = p.region
+            WHERE s.updated IS NULL OR s.updated < ?
+            ORDER BY p.hits DESC LIMIT ?
+        ''', (now - PRICE_POPULARITY_WINDOW, PRICE_INDEX_TOP, now - PRICE_SNAPSHOT_TTL / 2,
+              PRICE_INDEX_BATCH)).fetchall()
+    by_region = {}
+    for row in rows:
+        by_region.setdefault(row['region'], []).append(row['card'])
+    indexed = 0
+    for region, names in by_region.items():
+        cards = get_catalog_cards_by_name(current_catalog(), names)
+        if cards:
+            price_cards('price-indexer', cards, region, fresh=True)
+            indexed += len(cards)
+    with price_snapshot_lock:
+        price_snapshot_stats['index_passes'] += 1
+        price_snapshot_stats['indexed'] += indexed
+    return indexed
+
+
+def index_card_prices_periodically():
+    # Like the catalog refresh, every worker runs this loop but only the lock holder talks to eBay
+    leader_lock = open(f"{CACHE_DATABASE}.price-indexer.lock", 'w')
+    is_leader = False
+    while True:
+        try:
+            if not is_leader:
+                try:
+                    fcntl.flock(leader_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    is_leader = True
+                    logger.info("This worker (pid %d) now runs the price indexer", os.getpid())
+                except BlockingIOError:
+                    pass
+            if is_leader:
+                indexed = index_card_prices()
+                if indexed:
+                    logger.info("Price indexer refreshed %d cards", indexed)
+        except Exception:
+            logger.exception("Price indexing failed")
+        time.sleep(PRICE_INDEX_INTERVAL)
+
+
+def price_snapshot_summary():
+    with get_cache_db() as db:
+        snapshots = db.execute('SELECT COUNT(*) FROM card_price_snapshot').fetchone()[0]
+        tracked = db.execute('SELECT COUNT(*) FROM card_popularity').fetchone()[0]
+    with price_snapshot_lock:
+        stats = {key: price_snapshot_stats[key] for key in
+                 ('snapshot_hits', 'converted', 'live', 'fallbacks', 'endpoint_hits', 'index_passes', 'indexed')}
+    stats.update({'snapshots': snapshots, 'tracked_cards': tracked})
+    return stats
+
+
+# eBay OAuth token manager. The token is shared by every worker through cache.db; one refresh at a time per host
+# (thread lock + file lock), and a background thread renews it EBAY_TOKEN_REFRESH_AHEAD seconds before expiry so
+# request threads practically never wait on OAuth.
+EBAY_TOKEN_MARGIN = 120
+EBAY_TOKEN_REFRESH_AHEAD = int(os.getenv('EBAY_TOKEN_REFRESH_AHEAD', '600'))
+EBAY_TOKEN_RETRY_INTERVAL = 30
+ebay_token_lock = threading.Lock()
+
+
+def load_shared_ebay_token():
+    with get_cache_db() as db:
+        row = db.execute('SELECT token, expiry FROM ebay_token WHERE id = 1').fetchone()
+    return (row['token'], row['expiry']) if row else (None, 0)
+
+
+def request_ebay_access_token():
     credentials = f"{EBAY_CLIENT_ID}:{EBAY_CLIENT_SECRET}"
     b64credentials = base64.b64encode(credentials.encode()).decode()
     headers = {
@@ -720,35 +2880,157 @@ def get_ebay_access_token():
         "refresh_token": EBAY_REFRESH_TOKEN,
         "scope": "https://api.ebay.com/oauth/api_scope"
     }
-    resp = requests.post("https://api.ebay.com/identity/v1/oauth2/token", headers=headers, data=data)
+    now = time.time()
+    resp = http_request('POST', f"{EBAY_API_BASE}/identity/v1/oauth2/token", headers=headers, data=data)
     if resp.ok:
         tokens = resp.json()
-        ebay_access_token = tokens["access_token"]
-        ebay_token_expiry = now + int(tokens.get("expires_in", 7200))
-        return ebay_access_token
+        return tokens["access_token"], now + int(tokens.get("expires_in", 7200))
     else:
         raise Exception(f"Failed to refresh eBay access token: {resp.text}")
 
+
+def refresh_ebay_access_token(min_validity):
+    # Returns a token valid for at least min_validity seconds, only calling eBay if no thread or worker has one
+    global ebay_access_token, ebay_token_expiry
+    with ebay_token_lock:
+        if ebay_access_token and time.time() < ebay_token_expiry - min_validity:
+            return ebay_access_token
+        with open(f"{CACHE_DATABASE}.ebay-token.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                token, expiry = load_shared_ebay_token()
+                if not token or time.time() >= expiry - min_validity:
+                    token, expiry = request_ebay_access_token()
+                    with get_cache_db() as db:
+                        db.execute('INSERT OR REPLACE INTO ebay_token (id, token, expiry) VALUES (1, ?, ?)',
+                                   (token, expiry))
+                    logger.info("Refreshed eBay access token (pid %d)", os.getpid())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        ebay_access_token, ebay_token_expiry = token, expiry
+        return token
+
+
+def get_ebay_access_token():
+    # If we have a token and it's not expiring in the next 2 minutes, use it
+    if ebay_access_token and time.time() < ebay_token_expiry - EBAY_TOKEN_MARGIN:
+        return ebay_access_token
+    return refresh_ebay_access_token(EBAY_TOKEN_MARGIN)
+
+
+def refresh_ebay_token_periodically():
+    while True:
+        try:
+            refresh_ebay_access_token(EBAY_TOKEN_REFRESH_AHEAD)
+            delay = max(ebay_token_expiry - EBAY_TOKEN_REFRESH_AHEAD - time.time(), EBAY_TOKEN_RETRY_INTERVAL)
+        except Exception:
+            logger.exception("Background eBay token refresh failed")
+            delay = EBAY_TOKEN_RETRY_INTERVAL
+        time.sleep(delay)
+
+
+# Exchange rates: refreshed in the background from EXCHANGE_RATES_URL (any provider answering
+# {"base": ..., "rates": {...}}), kept in memory and persisted in cache.db so a restart or provider outage falls back
+# to the last good rates (and, before the first fetch ever, to the old hardcoded ones). Workers share the persisted
+# copy, so the provider is only asked about once per EXCHANGE_RATES_REFRESH.
+EXCHANGE_RATES_URL = os.getenv('EXCHANGE_RATES_URL', 'https://api.frankfurter.app/latest?from=USD')
+EXCHANGE_RATES_REFRESH = int(os.getenv('EXCHANGE_RATES_REFRESH', '3600'))
+EXCHANGE_RATES_RETRY = 300
+EXCHANGE_RATES_MAX_AGE = int(os.getenv('EXCHANGE_RATES_MAX_AGE', '900'))
+EXCHANGE_CURRENCIES = ('USD', 'GBP', 'EUR')
+DEFAULT_EXCHANGE_RATES = {'USD': 1.0, 'GBP': 0.79, 'EUR': 0.92}  # per USD
+exchange_rates_state = None
+
+
+def set_exchange_rates(rates, fetched):
+    # Rates are per USD; the endpoint serves every FROM_TO pair, pre-serialized with its ETag
+    global exchange_rates_state
+    pairs = {f"{a}_{b}": round(rates[b] / rates[a], 6) for a in EXCHANGE_CURRENCIES for b in EXCHANGE_CURRENCIES}
+    body = json.dumps(pairs, sort_keys=True).encode()
+    exchange_rates_state = {'rates': dict(rates), 'fetched': fetched, 'body': body,
+                            'etag': hashlib.sha1(body).hexdigest()}
+
+
+def load_persisted_exchange_rates():
+    with get_cache_db() as db:
+        row = db.execute('SELECT rates, fetched FROM exchange_rates WHERE id = 1').fetchone()
+    return (json.loads(row['rates']), row['fetched']) if row else None
+
+
+def fetch_exchange_rates():
+    response = http_request('GET', EXCHANGE_RATES_URL)
+    response.raise_for_status()
+    data = response.json()
+    rates = {code.upper(): float(value) for code, value in data['rates'].items()}
+    rates[(data.get('base') or data.get('base_code') or 'USD').upper()] = 1.0
+    missing = [code for code in EXCHANGE_CURRENCIES if code not in rates]
+    if missing:
+        raise ValueError(f"Exchange rate provider has no rate for {', '.join(missing)}")
+    return {code: rates[code] / rates['USD'] for code in EXCHANGE_CURRENCIES}
+
+
+def refresh_exchange_rates():
+    persisted = load_persisted_exchange_rates()
+    if persisted and time.time() - persisted[1] < EXCHANGE_RATES_REFRESH:
+        # Another worker already fetched them
+        set_exchange_rates(*persisted)
+        return
+    rates, fetched = fetch_exchange_rates(), time.time()
+    with get_cache_db() as db:
+        db.execute('INSERT OR REPLACE INTO exchange_rates (id, rates, fetched) VALUES (1, ?, ?)',
+                   (json.dumps(rates), fetched))
+    set_exchange_rates(rates, fetched)
+    logger.info("Refreshed exchange rates: %s", rates)
+
+
+def refresh_exchange_rates_periodically():
+    while True:
+        try:
+            refresh_exchange_rates()
+        except Exception:
+            logger.exception("Exchange rate refresh failed, keeping rates from %s", exchange_rates_state['fetched'])
+        delay = exchange_rates_state['fetched'] + EXCHANGE_RATES_REFRESH - time.time()
+        time.sleep(max(delay, EXCHANGE_RATES_RETRY))
+
+
+def convert_price(amount, from_currency, to_currency):
+    if from_currency == to_currency:
+        return amount
+    rates = exchange_rates_state['rates']
+    if from_currency not in rates or to_currency not in rates:
+        return None
+    return amount * rates[to_currency] / rates[from_currency]
+
+
+set_exchange_rates(*(load_persisted_exchange_rates() or (DEFAULT_EXCHANGE_RATES, 0)))
+
+
 @app.route('/api/exchange-rates')
 def exchange_rates():
-    # Hardcoded for demo; ideally fetch from a live API and cache hourly
-    rates = {
-        "USD_GBP": 0.79,
-        "EUR_GBP": 0.85,
-        "USD_USD": 1.0,
-        "EUR_USD": 1.09,
-    }
-    return jsonify(rates)
+    state = exchange_rates_state
+    response = app.response_class(state['body'], mimetype='application/json')
+    response.set_etag(state['etag'])
+    response.cache_control.public = True
+    response.cache_control.max_age = EXCHANGE_RATES_MAX_AGE
+    if state['fetched']:
+        response.last_modified = state['fetched']
+    return response.make_conditional(request)
 
 @app.route('/api/yugioh/cards', methods=['POST'])
 def get_card_data():
     logger.info("POST /api/yugioh/cards")
-    data = request.get_json(force=True, silent=True)
+    data = request.get_json(force=True, silent=True) or {}
     ids = data.get('ids', [])
     if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
         return jsonify({'error': 'Invalid or missing ID list'}), 400
-    results = [CARD_LOOKUP[i] for i in ids if i in CARD_LOOKUP]
-    return jsonify({'data': results})
+    fields = parse_card_fields(request.args.get('fields', data.get('fields')), 'full')
+    if fields is None:
+        return jsonify({'error': 'Invalid fields'}), 400
+    catalog = current_catalog()
+    if fields == 'summary':
+        rows = fetch_catalog_column(catalog, 'summary', 'id', ids)
+        return summary_response([rows[i] for i in ids if i in rows], 'data')
+    return jsonify({'data': [project_card(card, fields) for card in get_catalog_cards(catalog, ids)]})
 
 
 @app.route('/api/yugioh/search', methods=['GET'])
@@ -757,266 +3039,445 @@ def search_cards():
     query = request.args.get('q', '').strip().lower()
     if not query or len(query) < 2:
         return jsonify({'results': []})
-    matches = [card for card in ALL_CARDS if query in card.get('name', '').lower()]
-    return jsonify({'results': matches[:25]})
+    mode = request.args.get('mode', '').lower()
+    fields = parse_card_fields(request.args.get('fields'), 'summary')
+    if fields is None:
+        return jsonify({'error': 'Invalid fields'}), 400
+    catalog = current_catalog()
+    index = catalog['index']
+    positions = ranked_search(index, query) if mode == 'ranked' else search_index_lookup(index, query)
+    column = 'summary' if fields == 'summary' else 'data'
+    rows = fetch_catalog_column(catalog, column, 'pos', positions)
+    if fields == 'summary':
+        return summary_response([rows[pos] for pos in positions], 'results')
+    return jsonify({'results': [project_card(json.loads(rows[pos]), fields) for pos in positions]})
+
+
+DECK_SECTIONS = ['main', 'extra', 'side']
+DECK_CARD_FIELDS = ['id', 'name', 'type', 'card_images', 'card_prices']
+MAX_YDK_BYTES = 64 * 1024
+MAX_YDK_CARDS = 500
+DECK_CACHE_SIZE = 256
+deck_cache = OrderedDict()
+deck_cache_lock = threading.Lock()
+
+
+def parse_ydk(text):
+    # Same rules as the page's old client-side parser: #main / #extra / !side headers, any other #/! line ends a
+    # section. Ids are normalised so "0089631139" and "89631139" are the same card.
+    deck = {section: [] for section in DECK_SECTIONS}
+    section = None
+    for line in text.splitlines():
+        line = line.strip().lower()
+        if line.startswith(('#', '!')):
+            section = line[1:] if line[1:] in deck else None
+        elif line and section and line.isdigit():
+            deck[section].append(str(int(line)))
+    return deck
+
+
+def count_deck_ids(ids):
+    counts = OrderedDict()
+    for card_id in ids:
+        counts[card_id] = counts.get(card_id, 0) + 1
+    return [{'id': card_id, 'count': count} for card_id, count in counts.items()]
+
+
+def resolve_ydk(deck, fields):
+    # Each unique card once, plus per-section id/count lists. Resolved payloads are cached by deck content hash
+    # (and catalog generation, so a refresh never serves stale cards).
+    catalog = current_catalog()
+    key_source = json.dumps([catalog['generation'], fields, [deck[section] for section in DECK_SECTIONS]])
+    key = hashlib.sha256(key_source.encode()).hexdigest()
+    with deck_cache_lock:
+        body = deck_cache.get(key)
+        if body is not None:
+            deck_cache.move_to_end(key)
+            return body
+
+    ids = [card_id for section in DECK_SECTIONS for card_id in deck[section]]
+    cards = {str(card['id']): project_card(card, fields) for card in get_catalog_cards(catalog, list(dict.fromkeys(ids)))}
+    payload = {section: count_deck_ids(c for c in deck[section] if c in cards) for section in DECK_SECTIONS}
+    payload['cards'] = cards
+    payload['missing'] = [card_id for card_id in dict.fromkeys(ids) if card_id not in cards]
+    body = json.dumps(payload, separators=(',', ':')).encode()
+
+    with deck_cache_lock:
+        deck_cache[key] = body
+        deck_cache.move_to_end(key)
+        while len(deck_cache) > DECK_CACHE_SIZE:
+            deck_cache.popitem(last=False)
+    return body
+
+
+@app.route('/api/yugioh/deck', methods=['POST'])
+def resolve_deck():
+    # Accepts a .ydk upload ("file"), JSON {"ydk": "..."} or the raw .ydk text as the request body
+    logger.info("POST /api/yugioh/deck")
+    if 'file' in request.files:
+        raw = request.files['file'].read(MAX_YDK_BYTES + 1)
+    elif request.is_json:
+        body = request.get_json(silent=True)
+        ydk = body.get('ydk') if isinstance(body, dict) else None
+        if ydk is not None and not isinstance(ydk, str):
+            return jsonify({'error': 'ydk must be a string'}), 400
+        raw = (ydk or '').encode()
+    else:
+        raw = request.get_data(cache=False)[:MAX_YDK_BYTES + 1]
+    if not raw:
+        return jsonify({'error': 'Missing .ydk content'}), 400
+    if len(raw) > MAX_YDK_BYTES:
+        return jsonify({'error': 'Deck file too large'}), 400
+
+    deck = parse_ydk(raw.decode('utf-8', errors='replace'))
+    total = sum(len(deck[section]) for section in DECK_SECTIONS)
+    if total == 0:
+        return jsonify({'error': 'No cards found in deck'}), 400
+    if total > MAX_YDK_CARDS:
+        return jsonify({'error': 'Too many cards in deck'}), 400
+
+    fields = parse_card_fields(request.args.get('fields'), DECK_CARD_FIELDS)
+    if fields is None:
+        return jsonify({'error': 'Invalid fields'}), 400
+    return app.response_class(resolve_ydk(deck, fields), mimetype='application/json')
+
+
+def resolve_deck_cards(deck):
+    # Names and card_sets come from the catalog; the posted card is only a fallback for ids it doesn't know
+    sections = {section: [c for c in deck.get(section, []) if isinstance(c, dict)] for section in DECK_SECTIONS}
+    ids = [str(c.get('id')) for cards in sections.values() for c in cards]
+    known = {str(card['id']): card for card in get_catalog_cards(current_catalog(), ids)}
+    resolved = {}
+    for section, cards in sections.items():
+        resolved[section] = []
+        for card in cards:
+            source = known.get(str(card.get('id')), card)
+            if source.get('name'):
+                resolved[section].append({'id': source.get('id'), 'name': source['name'],
+                                          'card_sets': source.get('card_sets') or [],
+                                          'card_prices': source.get('card_prices') or [],
+                                          'ygoprodeck_url': source.get('ygoprodeck_url', '')})
+    return resolved
+
+
+# Price spreadsheets are built in openpyxl's write-only mode: rows are streamed straight to the output file, each cell
+# is written once, and formatting comes from named styles registered once per workbook instead of per-cell objects.
+PRICE_SHEET_COLUMNS = [("Card", 25), ("Set Codes", 20), ("Quantity", 10), ("Price", 13), ("URL", 45), ("Total", 12)]
+
+
+def new_price_workbook(currency):
+    wb = openpyxl.Workbook(write_only=True)
+    currency_format = '"$"#,##0.00' if currency == "USD" else '"£"#,##0.00'
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    center = Alignment(horizontal='center', vertical='center')
+    left = Alignment(horizontal='left', vertical='center')
+    styles = {
+        'price_section': dict(font=Font(bold=True, size=13), alignment=center,
+                              fill=PatternFill(start_color="A6CAF0", end_color="A6CAF0", fill_type="solid")),
+        'price_header': dict(font=Font(bold=True), alignment=center, border=border,
+                             fill=PatternFill(start_color="B7D3F2", end_color="B7D3F2", fill_type="solid")),
+        'price_text': dict(alignment=left, border=border),
+        'price_count': dict(alignment=center, border=border),
+        'price_money': dict(alignment=center, border=border, number_format=currency_format),
+        'price_total_label': dict(font=Font(bold=True), alignment=center, border=border),
+        'price_total': dict(font=Font(bold=True), alignment=center, border=border, number_format=currency_format),
+        'price_grand_label': dict(font=Font(bold=True, size=13), alignment=center, border=border),
+        'price_grand': dict(font=Font(bold=True, size=13), alignment=center, border=border,
+                            number_format=currency_format),
+    }
+    for name, attrs in styles.items():
+        wb.add_named_style(NamedStyle(name=name, **attrs))
+    return wb
+
+
+def write_price_sheet(wb, title, sections, price_results, on_section=None):
+    # Layout starts at B2: per section a merged title row, a header row, one row per card and a total row, then a
+    # grand total. Columns: B card, C set codes, D quantity, E price, F URL, G total. Returns the grand total cell.
+    ws = wb.create_sheet(title)
+    for idx, (_, width) in enumerate(PRICE_SHEET_COLUMNS, start=2):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+
+    def styled(value, style):
+        cell = WriteOnlyCell(ws, value)
+        cell.style = style
+        return cell
+
+    ws.append([])
+    row = 2
+    section_total_cells = []
+    for label, cards in sections:
+        ws.append([None, styled(label, 'price_section')])
+        ws.merged_cells.add(f"B{row}:G{row}")
+        ws.append([None] + [styled(head, 'price_header') for head, _ in PRICE_SHEET_COLUMNS])
+        row += 2
+        card_start_row = row
+
+        for card in cards:
+            setcodes_str, best_price, best_url = price_results.get(card['name'], ("", 0.0, ""))
+            ws.append([
+                None,
+                styled(card['name'], 'price_text'),
+                styled(setcodes_str, 'price_text'),
+                styled(card['count'], 'price_count'),
+                styled(best_price if best_price is not None else 0.0, 'price_money'),
+                styled(best_url, 'price_text'),
+                styled(f"=SUM(D{row}*E{row})", 'price_money'),
+            ])
+            row += 1
+
+        # Section totals
+        sum_formula = f"=SUM(G{card_start_row}:G{row - 1})" if cards else ""
+        ws.append([None] * 5 + [styled("Total", 'price_total_label'), styled(sum_formula, 'price_total')])
+        ws.append([])
+        section_total_cells.append(f"G{row}")
+        row += 2
+        if on_section:
+            on_section()
+
+    # Grand total row
+    grand_total = styled(f"=SUM({','.join(section_total_cells)})", 'price_grand') if section_total_cells else None
+    ws.append([None] * 5 + [styled("Total", 'price_grand_label'), grand_total])
+    return f"G{row}"
+
+
+def write_summary_sheet(ws, deck_totals):
+    # One row per deck sheet: card count and a formula pointing at that sheet's grand total
+    for column, width in zip('BCD', (32, 10, 14)):
+        ws.column_dimensions[column].width = width
+
+    def styled(value, style):
+        cell = WriteOnlyCell(ws, value)
+        cell.style = style
+        return cell
+
+    ws.append([])
+    ws.append([None, styled("Summary", 'price_section')])
+    ws.merged_cells.add("B2:D2")
+    ws.append([None] + [styled(head, 'price_header') for head in ("Deck", "Cards", "Total")])
+    row = 4
+    for title, count, total_cell in deck_totals:
+        sheet_ref = title.replace("'", "''")
+        ws.append([None, styled(title, 'price_text'), styled(count, 'price_count'),
+                   styled(f"='{sheet_ref}'!{total_cell}", 'price_money')])
+        row += 1
+    grand_total = f"=SUM(D4:D{row - 1})" if deck_totals else ""
+    ws.append([None, None, styled("Total", 'price_grand_label'), styled(grand_total, 'price_grand')])
+
+
+def price_sheet_title(name, used):
+    # Excel sheet names: at most 31 characters, none of []:*?/\ and unique (case-insensitively) within a workbook
+    base = re.sub(r'[\[\]:*?/\\]', ' ', name).strip().strip("'")[:31] or "Deck"
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def group_cards(cards):
+    grouped = {}
+    for card in cards:
+        key = card['name']
+        grouped.setdefault(key, {'name': card['name'], 'count': 0, **card})
+        grouped[key]['count'] += 1
+    return list(grouped.values())
+
+
+def generate_price_workbook(job_id, decks, currency, summary=False, fresh=False):
+    # decks is a list of (sheet name, resolved deck). Every unique card across all decks is priced once (from its
+    # price snapshot unless fresh), then each deck gets its own sheet (plus a summary sheet in front for bulk exports).
+    logger.info("Starting XLSX generation for job_id=%s, region=%s, decks: %d, cards: %d", job_id, currency,
+                len(decks), sum(len(deck.get(section, [])) for _, deck in decks for section in DECK_SECTIONS))
+    try:
+        region = 'US' if currency == 'USD' else 'GB'
+        section_order = [('main', 'Main Deck'), ('extra', 'Extra Deck'), ('side', 'Side Deck')]
+        grouped = [(title, [(label, group_cards(deck.get(section, []))) for section, label in section_order])
+                   for title, deck in decks]
+
+        # --- Collect all unique card queries
+        all_card_queries = {}
+        quantities = Counter()
+        for _, sections in grouped:
+            for _, cards in sections:
+                for card in cards:
+                    all_card_queries[card['name']] = card
+                    quantities[card['name']] += card['count']
+        if len(decks) > 1:
+            logger.info("Bulk export job_id=%s: %d card entries across %d decks, %d unique cards to price", job_id,
+                        sum(len(cards) for _, sections in grouped for _, cards in sections), len(decks),
+                        len(all_card_queries))
+
+        # --- Price every card: all setcode queries for the whole export are in flight at once
+        progress = 0
+        progress_steps = len(all_card_queries) + len(grouped) * len(section_order) + 1
+        max_percent = 0
+        running_total = 0.0
+
+        def card_priced(card_name, result):
+            nonlocal progress, max_percent, running_total
+            # progress per card, streamed to the browser along with the running total
+            progress += 1
+            max_percent = max(int(100 * progress / progress_steps), max_percent)
+            running_total += result[1] * quantities[card_name]
+            add_job_event(job_id, 'card', {
+                'card': card_name, 'price': result[1], 'quantity': quantities[card_name],
+                'total': round(running_total, 2), 'progress': max_percent,
+            }, progress=max_percent)
+
+        def sheet_step():
+            nonlocal progress, max_percent
+            progress += 1
+            percent = min(int(100 * progress / progress_steps) + random.randint(3, 6), 99)
+            max_percent = max(percent, max_percent)
+            update_job(job_id, progress=max_percent)
+
+        record_card_demand([card['name'] for _, sections in grouped for _, cards in sections for card in cards], region)
+        price_results = price_cards(job_id, all_card_queries, region, on_card=card_priced, fresh=fresh)
+
+        # --- Now, generate the sheets, using the fetched prices
+        wb = new_price_workbook(currency)
+        used_titles = set()
+        summary_ws = wb.create_sheet(price_sheet_title("Summary", used_titles)) if summary else None
+        deck_totals = []
+        for title, sections in grouped:
+            title = price_sheet_title(title, used_titles)
+            total_cell = write_price_sheet(wb, title, sections, price_results, on_section=sheet_step)
+            deck_totals.append((title, sum(card['count'] for _, cards in sections for card in cards), total_cell))
+        if summary_ws is not None:
+            write_summary_sheet(summary_ws, deck_totals)
+        wb.save(job_temp_path(job_id))
+        sheet_step()
+        finish_job(job_id)
+    except Exception as e:
+        logger.exception("XLSX generation failed for job_id=%s", job_id)
+        fail_job(job_id, str(e))
 
 
 @app.route('/api/yugioh/ebay-xlsx/start', methods=['POST'])
 def ebay_xlsx_start():
     logger.info("POST /api/yugioh/ebay-xlsx/start")
     req = request.get_json(force=True, silent=True)
-    deck = req.get('deck', {})
+    deck = resolve_deck_cards(req.get('deck', {}))
     currency = req.get('currency', 'GBP').upper()
-    job_id = str(uuid.uuid4())
-    generation_jobs[job_id] = {'progress': 0, 'ready': False, 'file': None, 'error': None}
-    total = sum(len(deck.get(section, [])) for section in ['main', 'extra', 'side'])
+    fresh = bool(req.get('fresh'))
+    job_id = create_job('ebay-xlsx')
+    total = sum(len(deck.get(section, [])) for section in DECK_SECTIONS)
     if total == 0:
-        generation_jobs[job_id]['ready'] = True
-        generation_jobs[job_id]['error'] = "Deck is empty."
+        fail_job(job_id, "Deck is empty.")
         return jsonify({'job_id': job_id}), 202
 
-    def group_cards(cards):
-        grouped = {}
-        for card in cards:
-            key = card['name']
-            grouped.setdefault(key, {'name': card['name'], 'count': 0, **card})
-            grouped[key]['count'] += 1
-        return list(grouped.values())
-
-    def do_work():
-        logging.info(
-            f"Starting XLSX generation for job_id={job_id}, region={currency}, deck size: {sum(len(deck.get(section, [])) for section in ['main', 'extra', 'side'])}")
-        try:
-            region = 'US' if currency == 'USD' else 'GB'
-            output = io.BytesIO()
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "eBay Prices"
-
-            section_fill = PatternFill(start_color="A6CAF0", end_color="A6CAF0", fill_type="solid")
-            header_fill = PatternFill(start_color="B7D3F2", end_color="B7D3F2", fill_type="solid")
-            border = Border(left=Side(style='thin'), right=Side(style='thin'),
-                            top=Side(style='thin'), bottom=Side(style='thin'))
-            bold = Font(bold=True)
-            big_bold = Font(bold=True, size=13)
-            center = Alignment(horizontal='center', vertical='center')
-            left = Alignment(horizontal='left', vertical='center')
-
-            columns = [("Card", 25), ("Set Codes", 20), ("Quantity", 10), ("Price", 13), ("URL", 45), ("Total", 12)]
-            section_order = [('main', 'Main Deck'), ('extra', 'Extra Deck'), ('side', 'Side Deck')]
-            currency_format = '"$"#,##0.00' if currency == "USD" else '"£"#,##0.00'
-            col_base = 2
-            row = 2
-            section_total_cells = []
-
-            # --- Collect all unique card queries
-            all_card_queries = {}
-            for section, _ in section_order:
-                for card in group_cards(deck.get(section, [])):
-                    setcodes = []
-                    if 'card_sets' in card and card['card_sets']:
-                        setcodes = [s['set_code'] for s in card['card_sets'] if 'EN' in s['set_code']]
-                    all_card_queries[card['name']] = setcodes
-
-            # --- Prepare price lookups in parallel
-            price_results = {}
-
-            def lookup_card(card_name, setcodes):
-                best_price = None
-                best_url = ""
-                setcodes_str = ", ".join(setcodes) if setcodes else ""
-                # Query eBay for each EN setcode, use lowest price
-                for code in setcodes:
-                    query = f"{code} {card_name}"
-                    ebay_results = get_ebay_prices(query, region=region)
-                    filtered = [x for x in ebay_results if x['price'] != "N/A"]
-                    if filtered:
-                        def price_to_float(p):
-                            try:
-                                return float(p['price'].replace('£', '').replace('$', '').split()[0])
-                            except Exception:
-                                return float('inf')
-
-                        cheapest = min(filtered, key=price_to_float)
-                        price = price_to_float(cheapest)
-                        if best_price is None or price < best_price:
-                            best_price = price
-                            best_url = cheapest['url']
-                # If no EN setcode found, fallback to card name
-                if best_price is None:
-                    ebay_results = get_ebay_prices(card_name, region=region)
-                    filtered = [x for x in ebay_results if x['price'] != "N/A"]
-                    if filtered:
-                        def price_to_float(p):
-                            try:
-                                return float(p['price'].replace('£', '').replace('$', '').split()[0])
-                            except Exception:
-                                return float('inf')
-
-                        cheapest = min(filtered, key=price_to_float)
-                        best_price = price_to_float(cheapest)
-                        best_url = cheapest['url']
-                return (setcodes_str, best_price if best_price is not None else 0.0, best_url)
-
-            with ThreadPoolExecutor(max_workers=8) as executor:
-                future_to_name = {
-                    executor.submit(lookup_card, card_name, setcodes): card_name
-                    for card_name, setcodes in all_card_queries.items()
-                }
-                num_cards = len(all_card_queries)
-                extra_steps = len(section_order) + 2
-                progress = 0
-                progress_steps = num_cards + extra_steps
-                max_percent = 0
-
-                for future in as_completed(future_to_name):
-                    card_name = future_to_name[future]
-                    try:
-                        price_results[card_name] = future.result()
-                    except Exception as e:
-                        logging.exception(f"Failed to fetch price for {card_name}")
-                        price_results[card_name] = ("", 0.0, "")
-                    # progress per card
-                    progress += 1
-                    percent = int(100 * progress / progress_steps)
-                    max_percent = max(percent, max_percent)
-                    generation_jobs[job_id]['progress'] = max_percent
-
-            # --- Now, generate the sheet as before, using the fetched prices
-            for section, label in section_order:
-                cards = group_cards(deck.get(section, []))
-                ws.merge_cells(start_row=row, start_column=col_base, end_row=row,
-                               end_column=col_base + len(columns) - 1)
-                cell = ws.cell(row=row, column=col_base, value=label)
-                cell.fill = section_fill
-                cell.font = big_bold
-                cell.alignment = center
-                row += 1
-
-                # Headers
-                for idx, (head, _) in enumerate(columns, start=col_base):
-                    c = ws.cell(row=row, column=idx, value=head)
-                    c.fill = header_fill
-                    c.font = bold
-                    c.alignment = center
-                    c.border = border
-
-                row += 1
-                card_start_row = row
-
-                for card in cards:
-                    setcodes_str, best_price, best_url = price_results.get(card['name'], ("", 0.0, ""))
-
-                    ws.cell(row=row, column=col_base, value=card['name']).alignment = left
-                    ws.cell(row=row, column=col_base).border = border
-
-                    ws.cell(row=row, column=col_base + 1, value=setcodes_str).alignment = left
-                    ws.cell(row=row, column=col_base + 1).border = border
-
-                    ws.cell(row=row, column=col_base + 2, value=card['count']).alignment = center
-                    ws.cell(row=row, column=col_base + 2).border = border
-
-                    price_cell = ws.cell(row=row, column=col_base + 3,
-                                         value=best_price if best_price is not None else 0.0)
-                    price_cell.number_format = currency_format
-                    price_cell.alignment = center
-                    price_cell.border = border
-
-                    ws.cell(row=row, column=col_base + 4, value=best_url).alignment = left
-                    ws.cell(row=row, column=col_base + 4).border = border
-
-                    quantity_ref = f"{get_column_letter(col_base + 2)}{row}"
-                    price_ref = f"{get_column_letter(col_base + 3)}{row}"
-                    total_cell = ws.cell(row=row, column=col_base + 5)
-                    total_cell.value = f"=SUM({quantity_ref}*{price_ref})"
-                    total_cell.number_format = currency_format
-                    total_cell.alignment = center
-                    total_cell.border = border
-
-                    row += 1
-
-                # Section totals
-                ws.cell(row=row, column=col_base + 4, value="Total").font = bold
-                ws.cell(row=row, column=col_base + 4).alignment = center
-                ws.cell(row=row, column=col_base + 4).border = border
-                sum_formula = f"=SUM({get_column_letter(col_base + 5)}{card_start_row}:{get_column_letter(col_base + 5)}{row - 1})" if cards else ""
-                total_sum_cell = ws.cell(row=row, column=col_base + 5, value=sum_formula)
-                total_sum_cell.font = bold
-                total_sum_cell.number_format = currency_format
-                total_sum_cell.alignment = center
-                total_sum_cell.border = border
-                section_total_cells.append(total_sum_cell.coordinate)
-                row += 2
-
-                inc = random.randint(4, 7)
-                progress += 1
-                percent = min(int(100 * progress / progress_steps) + inc, 99)
-                max_percent = max(percent, max_percent)
-                generation_jobs[job_id]['progress'] = max_percent
-
-            # Grand total row (randomize fake step)
-            ws.cell(row=row, column=col_base + 4, value="Total").font = big_bold
-            ws.cell(row=row, column=col_base + 4).alignment = center
-            ws.cell(row=row, column=col_base + 4).border = border
-            if section_total_cells:
-                sum_formula = f"=SUM({','.join(section_total_cells)})"
-                total_cell = ws.cell(row=row, column=col_base + 5, value=sum_formula)
-                total_cell.font = big_bold
-                total_cell.number_format = currency_format
-                total_cell.alignment = center
-                total_cell.border = border
-
-            inc = random.randint(3, 5)
-            progress += 1
-            percent = min(int(100 * progress / progress_steps) + inc, 99)
-            max_percent = max(percent, max_percent)
-            generation_jobs[job_id]['progress'] = max_percent
+    threading.Thread(target=generate_price_workbook, args=(job_id, [("eBay Prices", deck)], currency, False, fresh),
+                     daemon=True).start()
+    return jsonify({'job_id': job_id}), 202
 
-            for idx, (_, width) in enumerate(columns, start=col_base):
-                ws.column_dimensions[get_column_letter(idx)].width = width
 
-            wb.save(output)
-            output.seek(0)
-            inc = random.randint(1, 4)
-            progress += 1
-            percent = min(int(100 * progress / progress_steps) + inc, 99)
-            max_percent = max(percent, max_percent)
-            generation_jobs[job_id]['progress'] = max_percent
+# Bulk export for tournament organisers: many decks in one workbook, each unique card priced once across all of them
+MAX_BULK_DECKS = int(os.getenv('MAX_BULK_DECKS', '200'))
+MAX_BULK_UPLOAD_BYTES = 16 * 1024 * 1024
 
-            generation_jobs[job_id]['file'] = output.read()
-            generation_jobs[job_id]['ready'] = True
-            generation_jobs[job_id]['progress'] = 100
-        except Exception as e:
-            generation_jobs[job_id]['error'] = str(e)
-            generation_jobs[job_id]['ready'] = True
-            generation_jobs[job_id]['progress'] = 100
 
-    threading.Thread(target=do_work, daemon=True).start()
-    return jsonify({'job_id': job_id}), 202
+def read_bulk_decks():
+    # Returns ([(name, deck)], error). Accepts a zip of .ydk files ("file") or JSON
+    # {"decks": [{"name": ..., "ydk": "..."} or {"name": ..., "deck": {"main": [{"id": ...}], ...}}]}
+    decks = []
+    if 'file' in request.files:
+        upload = request.files['file'].read(MAX_BULK_UPLOAD_BYTES + 1)
+        if len(upload) > MAX_BULK_UPLOAD_BYTES:
+            return None, "Upload too large"
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(upload))
+        except zipfile.BadZipFile:
+            return None, "Upload must be a .zip of .ydk files"
+        entries = [info for info in archive.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith('.ydk')
+                   and not os.path.basename(info.filename).startswith('.')]
+        if len(entries) > MAX_BULK_DECKS:
+            return None, f"Too many decks (max {MAX_BULK_DECKS})"
+        for info in sorted(entries, key=lambda i: i.filename.lower()):
+            if info.file_size > MAX_YDK_BYTES:
+                return None, f"Deck file too large: {info.filename}"
+            with archive.open(info) as f:
+                text = f.read(MAX_YDK_BYTES + 1).decode('utf-8', errors='replace')
+            decks.append((os.path.basename(info.filename)[:-len('.ydk')], parse_ydk(text)))
+    else:
+        body = request.get_json(silent=True) or {}
+        posted = body.get('decks')
+        if not isinstance(posted, list):
+            return None, "Missing decks"
+        if len(posted) > MAX_BULK_DECKS:
+            return None, f"Too many decks (max {MAX_BULK_DECKS})"
+        for i, entry in enumerate(posted, start=1):
+            if not isinstance(entry, dict):
+                return None, "Invalid deck entry"
+            name = str(entry.get('name') or f"Deck {i}")
+            if isinstance(entry.get('ydk'), str):
+                decks.append((name, parse_ydk(entry['ydk'][:MAX_YDK_BYTES])))
+            elif isinstance(entry.get('deck'), dict):
+                decks.append((name, entry['deck']))
+            else:
+                return None, f"Deck {name} has no ydk or deck"
+
+    resolved = []
+    for name, deck in decks:
+        # parse_ydk gives bare ids per section; the catalog fills in names and set codes
+        deck = {section: [card if isinstance(card, dict) else {'id': card} for card in deck.get(section) or []]
+                for section in DECK_SECTIONS}
+        if sum(len(cards) for cards in deck.values()) > MAX_YDK_CARDS:
+            return None, f"Too many cards in deck {name}"
+        deck = resolve_deck_cards(deck)
+        if any(deck.values()):
+            resolved.append((name, deck))
+    if not resolved:
+        return None, "No cards found in any deck"
+    return resolved, None
+
+
+@app.route('/api/yugioh/ebay-xlsx/bulk', methods=['POST'])
+def ebay_xlsx_bulk():
+    logger.info("POST /api/yugioh/ebay-xlsx/bulk")
+    decks, error = read_bulk_decks()
+    if error:
+        return jsonify({'error': error}), 400
+    body = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    currency = (body.get('currency') or 'GBP').upper()
+    fresh = str(body.get('fresh', '')).lower() in ('1', 'true')
+    job_id = create_job('ebay-xlsx-bulk')
+    threading.Thread(target=generate_price_workbook, args=(job_id, decks, currency, True, fresh), daemon=True).start()
+    return jsonify({'job_id': job_id, 'decks': len(decks)}), 202
 
 
 @app.route('/api/yugioh/ebay-xlsx/progress')
 def ebay_xlsx_progress():
     job_id = request.args.get('job_id')
-    job = generation_jobs.get(job_id)
+    job = get_job(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     return jsonify({
         'progress': job['progress'],
-        'ready': job['ready'],
+        'ready': bool(job['ready']),
         'error': job['error']
     })
 
 
+@app.route('/api/yugioh/ebay-xlsx/events')
+def ebay_xlsx_events():
+    # One long-lived Server-Sent Events connection per job instead of polling /progress
+    job_id = request.args.get('job_id')
+    if not get_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    return job_events_response(job_id, f"/api/yugioh/ebay-xlsx/download?job_id={job_id}")
+
+
 @app.route('/api/yugioh/ebay-xlsx/download')
 def ebay_xlsx_download():
     logger.info(f"GET /api/yugioh/ebay-xlsx/download job_id={request.args.get('job_id')}")
     job_id = request.args.get('job_id')
-    job = generation_jobs.get(job_id)
-    if not job or not job.get('ready') or not job.get('file'):
+    job = get_job(job_id)
+    if not job or not job['ready'] or not job['size'] or not os.path.exists(job_file_path(job_id)):
         return jsonify({'error': 'Not ready'}), 400
     return send_file(
-        io.BytesIO(job['file']),
+        os.path.abspath(job_file_path(job_id)),
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         as_attachment=True,
         download_name='ebay_prices.xlsx'
@@ -1030,8 +3491,59 @@ def yugioh_ebay_prices():
     region = request.args.get('region', 'GB').upper()
     if not card_name:
         return jsonify({'error': 'Missing card name'}), 400
-    results = get_ebay_prices(card_name, region=region)
-    return jsonify({'results': results})
+    fresh = request.args.get('fresh') == '1'
+
+    # Catalog cards count towards the price indexer's popularity. When one has a snapshot, the answer is the snapshot
+    # (the cheapest price found by the indexer) plus whatever listings are cached, without a live eBay call.
+    card = next(iter(get_catalog_cards_by_name(current_catalog(), [card_name]).values()), None)
+    if card:
+        record_card_demand([card['name']], region)
+        snapshot = None if fresh else load_price_snapshots([card['name']], region).get(card['name'])
+        if snapshot:
+            with price_snapshot_lock:
+                price_snapshot_stats['endpoint_hits'] += 1
+            return jsonify({'results': cached_ebay_prices(card_name, region), 'source': 'snapshot', 'snapshot': {
+                'price': f"{snapshot['price']:.2f} {region_currency(region)}",
+                'url': snapshot['url'],
+                'set_codes': snapshot['setcodes'],
+                'updated': snapshot['updated'],
+            }})
+
+    try:
+        results = get_ebay_prices(card_name, region=region, raise_errors=fresh, fresh=fresh)
+    except Exception:
+        # A fresh lookup that failed says so: the listings are from the cache, or there is nothing to show
+        logger.exception("Live eBay lookup failed for %s (%s)", card_name, region)
+        results = cached_ebay_prices(card_name, region)
+        if not results:
+            return jsonify({'error': 'Live eBay lookup failed'}), 502
+        return jsonify({'results': results, 'source': 'cache'})
+    fallback = ygoprodeck_price(card, region) if card and not results else None
+    if fallback:
+        return jsonify({'results': [{'title': card['name'], 'price': f"{fallback[0]:.2f} {region_currency(region)}",
+                                     'condition': 'Unknown', 'url': fallback[1]}], 'source': 'ygoprodeck'})
+    return jsonify({'results': results, 'source': 'live'})
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Stats Endpoint
+# ----------------------------------------------------------------------------------------------------------------------
+@app.route('/api/stats')
+def service_stats():
+    # Counters are per worker process; pid tells you which one answered
+    return jsonify({
+        'pid': os.getpid(),
+        'ebay_cache': ebay_cache_summary(),
+        'ebay_single_flight': ebay_flight_summary(),
+        'ebay_scheduler': ebay_scheduler.summary(),
+        'ebay_query_planner': ebay_planner_summary(),
+        'http_pools': http_pool_summary(),
+        'jobs': job_store_summary(),
+        'converter': converter_summary(),
+        'conversion_cache': conversion_cache_summary(),
+        'scratch': scratch_summary(),
+        'price_snapshots': price_snapshot_summary(),
+    })
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -1039,11 +3551,39 @@ def yugioh_ebay_prices():
 # ----------------------------------------------------------------------------------------------------------------------
 if USE_LIMITER:
     limiter.exempt(ebay_xlsx_progress)
+    limiter.exempt(ebay_xlsx_events)
+    limiter.exempt(convert_status)
+    limiter.exempt(convert_events)
+    limiter.exempt(exchange_rates)
     limiter.exempt(render_markdown)
     limiter.exempt(search_cards)
+    limiter.exempt(get_card_data)
+
+def start_background_workers():
+    # Start background card update loop
+    threading.Thread(target=update_cards_periodically, daemon=True).start()
+
+    # Keep exchange rates current
+    threading.Thread(target=refresh_exchange_rates_periodically, daemon=True).start()
+
+    # Expire finished jobs and keep their files within the byte budget
+    threading.Thread(target=cleanup_jobs_periodically, daemon=True).start()
+
+    # Remove scratch directories left behind by crashed or killed workers
+    threading.Thread(target=sweep_scratch_periodically, daemon=True).start()
+
+    # Keep the eBay token renewed ahead of expiry
+    if EBAY_CLIENT_ID and EBAY_CLIENT_SECRET and EBAY_REFRESH_TOKEN:
+        threading.Thread(target=refresh_ebay_token_periodically, daemon=True).start()
+        # Keep price snapshots of the most requested cards fresh
+        threading.Thread(target=index_card_prices_periodically, daemon=True).start()
+
 
-# Start background card update loop
-threading.Thread(target=update_cards_periodically, daemon=True).start()
+# Gunicorn workers import this module and run the loops; converter pool workers that re-import it as __main__ (when
+# the app is started directly) must not. BACKGROUND_WORKERS=0 turns them off, e.g. for tests.
+BACKGROUND_WORKERS = os.getenv('BACKGROUND_WORKERS', '1') != '0'
+if BACKGROUND_WORKERS and multiprocessing.current_process().name == 'MainProcess':
+    start_background_workers()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5010, debug=True)
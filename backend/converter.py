@@ -0,0 +1,202 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+import pdfkit
+from docx import Document
+from markdown2 import markdown
+
+# File conversions. These run in the converter process pool (see app.py), which imports this module in fresh worker
+# processes, so it only pulls in what the conversions themselves need.
+WKHTMLTOPDF_PATH = os.getenv('WKHTMLTOPDF_PATH', '/usr/bin/wkhtmltopdf')
+FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')
+AUDIO_FORMATS = ('mp3', 'wav', 'ogg')
+PDF_RENDERER_MAX_JOBS = int(os.getenv('PDF_RENDERER_MAX_JOBS', '50'))
+PDF_RENDER_TIMEOUT = int(os.getenv('PDF_RENDER_TIMEOUT', '120'))
+# Part of the conversion cache key (see app.py); bump it whenever a change here alters the output for the same input
+CONVERTER_VERSION = '3'
+
+
+def conversion_kind(filename, target_format):
+    # Which conversion handles this upload, or None if it isn't supported
+    if filename.endswith(('.txt', '.md', '.html', '.docx')) and target_format == 'pdf':
+        return 'pdf'
+    if filename.endswith('.docx') and target_format == 'txt':
+        return 'txt'
+    if filename.endswith(('.mp3', '.wav', '.ogg')) and target_format in AUDIO_FORMATS:
+        return 'audio'
+    return None
+
+
+def ffmpeg_command(filename, target_format, source='pipe:0', target='pipe:1'):
+    # ffmpeg transcodes packet by packet, so the audio is never decoded into memory as a whole (pydub's
+    # AudioSegment.from_file held the full PCM). The defaults read stdin and write stdout, for streaming.
+    return [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-f', os.path.splitext(filename)[1].lstrip('.'),
+            '-i', source, '-vn', '-f', target_format, '-y', target]
+
+
+class RendererUnavailable(Exception):
+    pass
+
+
+class PdfRenderer:
+    # One long-lived `wkhtmltopdf --read-args-from-stdin` per pool worker, so Qt/WebKit and the fonts are loaded once
+    # instead of on every conversion. Each job is one line of "<input> <output>" on its stdin and is finished when
+    # wkhtmltopdf reports Done on stderr. The process is replaced when it has died, after PDF_RENDERER_MAX_JOBS jobs
+    # (WebKit's memory only grows) and after a job overruns PDF_RENDER_TIMEOUT.
+
+    def __init__(self):
+        self.process = None
+        self.lines = None
+        self.jobs = 0
+        self.started = 0
+
+    def healthy(self):
+        return self.process is not None and self.process.poll() is None and self.jobs < PDF_RENDERER_MAX_JOBS
+
+    def start(self):
+        self.stop()
+        try:
+            self.process = subprocess.Popen([WKHTMLTOPDF_PATH, '--encoding', 'utf-8', '--read-args-from-stdin'],
+                                            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                            text=True, bufsize=1)
+        except OSError as e:
+            raise RendererUnavailable(str(e))
+        # Its own queue per process, so nothing a replaced renderer still prints reaches the next one
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_errors, args=(self.process, self.lines), daemon=True).start()
+        self.jobs = 0
+        self.started += 1
+
+    @staticmethod
+    def read_errors(process, lines):
+        # Text mode splits wkhtmltopdf's \r progress bars into lines too
+        for line in process.stderr:
+            lines.put(line.strip())
+        lines.put(None)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def render(self, html_path, output_path):
+        while self.lines is not None and not self.lines.empty():
+            self.lines.get_nowait()
+        if not self.healthy():
+            self.start()
+        self.jobs += 1
+        try:
+            self.process.stdin.write(f'"{os.path.abspath(html_path)}" "{os.path.abspath(output_path)}"\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            self.stop()
+            raise RendererUnavailable(str(e))
+
+        deadline = time.monotonic() + PDF_RENDER_TIMEOUT
+        errors = []
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError(f"wkhtmltopdf took longer than {PDF_RENDER_TIMEOUT}s")
+            if line is None:
+                # wkhtmltopdf exits when a job fails; without errors it died for reasons of its own
+                self.stop()
+                if errors:
+                    break
+                raise RendererUnavailable("wkhtmltopdf exited")
+            if line == 'Done':
+                break
+            if line.startswith(('Error', 'Exit with code')):
+                errors.append(line)
+        if self.process is None or self.jobs >= PDF_RENDERER_MAX_JOBS:
+            # Replace it now rather than making the next job wait for a cold start
+            try:
+                self.start()
+            except RendererUnavailable:
+                pass
+        if errors or not os.path.exists(output_path) or not os.path.getsize(output_path):
+            raise RuntimeError(f"wkhtmltopdf failed: {'; '.join(errors[-5:])}")
+
+
+pdf_renderer = PdfRenderer()
+
+
+def warm_up():
+    # Pool worker initializer: start the renderer and put one page through it, so WebKit and the fonts are loaded
+    # before the first real PDF job
+    if pdf_renderer.healthy():
+        return
+    with tempfile.TemporaryDirectory() as work_dir:
+        html_path = os.path.join(work_dir, 'warm-up.html')
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write('<p>warm-up</p>')
+        try:
+            pdf_renderer.render(html_path, os.path.join(work_dir, 'warm-up.pdf'))
+        except (RendererUnavailable, RuntimeError):
+            pass
+
+
+def render_pdf(html_path, output_path):
+    # Returns which renderer produced the PDF
+    try:
+        pdf_renderer.render(html_path, output_path)
+        return 'warm'
+    except RendererUnavailable:
+        # No long-lived renderer to be had (e.g. a wkhtmltopdf build without --read-args-from-stdin): one-shot it
+        config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+        pdfkit.from_file(html_path, output_path, configuration=config)
+        return 'oneshot'
+
+
+def run_conversion(input_path, filename, target_format, output_path):
+    # Returns what ran and how long it took, for the converter stats
+    started = time.monotonic()
+    kind = conversion_kind(filename, target_format)
+    renderer = None
+
+    # Document → PDF
+    if kind == 'pdf':
+        # HTML goes to the renderer as uploaded; everything else is turned into an HTML file beside it first
+        html_path = input_path
+        if not filename.endswith('.html'):
+            if filename.endswith('.md') or filename.endswith('.txt'):
+                with open(input_path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+                html = markdown(text) if filename.endswith('.md') else f"<pre>{text}</pre>"
+            else:
+                doc = Document(input_path)
+                html = ''.join(f"<p>{para.text}</p>" for para in doc.paragraphs)
+            html_path = os.path.join(os.path.dirname(input_path), 'render.html')
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+
+        renderer = render_pdf(html_path, output_path)
+
+    # DOCX → TXT
+    elif kind == 'txt':
+        doc = Document(input_path)
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for para in doc.paragraphs:
+                out.write(para.text + '\n')
+
+    # Audio conversion
+    elif kind == 'audio':
+        result = subprocess.run(ffmpeg_command(filename, target_format, input_path, output_path),
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode:
+            raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-500:]}")
+
+    else:
+        raise ValueError(f"Unsupported conversion: {filename} -> {target_format}")
+    return {'kind': kind, 'renderer': renderer, 'seconds': time.monotonic() - started}
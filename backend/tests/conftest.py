@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py reads its settings and opens its databases (relative to the working directory) at import time
+for name in ('SENDGRID_API_KEY', 'RECEIVER_EMAIL', 'VERIFIED_SENDER', 'STRIPE_SECRET_KEY', 'STRIPE_WEBHOOK_SECRET'):
+    os.environ.setdefault(name, 'test')
+os.environ.setdefault('SCRATCH_DIR', tempfile.mkdtemp())
+# No card refresh, exchange rate or cleanup threads, and nothing that could reach the real APIs
+os.environ['BACKGROUND_WORKERS'] = '0'
+for name, path in (('YGOPRODECK_CARDS_URL', 'cardinfo.php'), ('YGOPRODECK_DBVER_URL', 'checkDBVer.php'),
+                   ('EXCHANGE_RATES_URL', 'latest?from=USD')):
+    os.environ[name] = f'http://127.0.0.1:9/{path}'
+os.chdir(tempfile.mkdtemp())
+with open('cards.json', 'w') as f:
+    f.write('{"data": []}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    if app.USE_LIMITER:
+        app.limiter.enabled = False
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,45 @@
+import os
+import random
+
+
+def publish_new_generation(app_module):
+    generation = app_module.read_catalog_generation() + 1
+    app_module.build_card_catalog(app_module.CARDS_JSON, app_module.catalog_snapshot_path(generation))
+    app_module.publish_catalog_generation(generation)
+    return generation
+
+
+def test_snapshot_in_use_survives_later_publishes(app_module):
+    held = app_module.open_card_catalog(publish_new_generation(app_module))
+    for _ in range(app_module.CATALOG_SNAPSHOTS_KEPT + 1):
+        publish_new_generation(app_module)
+    # A thread that hasn't opened its connection yet can still do so
+    assert os.path.exists(held['path'])
+    app_module.catalog_connection(held).execute('SELECT COUNT(*) FROM cards').fetchone()
+
+    path = held['path']
+    del held
+    latest = publish_new_generation(app_module)
+    assert not os.path.exists(path)
+    assert os.path.exists(app_module.catalog_snapshot_path(latest))
+
+
+def test_patched_search_index_matches_a_full_rebuild(app_module):
+    rng = random.Random(5)
+    words = ['Dark', 'Magician', 'Blue-Eyes', 'White', 'Dragon', 'Girl', 'of', 'Chaos', 'Red-Eyes', 'Black']
+    cards = [(str(card_id), ' '.join(rng.sample(words, 3))) for card_id in range(200)]
+    index = app_module.build_search_index(*zip(*cards))
+    next_id = len(cards)
+    for _ in range(20):
+        for _ in range(rng.randint(0, 3)):
+            cards.pop(rng.randrange(len(cards)))
+        for _ in range(rng.randint(0, 3)):
+            cards.insert(rng.randrange(len(cards) + 1), (str(next_id), ' '.join(rng.sample(words, 2))))
+            next_id += 1
+        for _ in range(rng.randint(0, 3)):
+            pos = rng.randrange(len(cards))
+            cards[pos] = (cards[pos][0], cards[pos][1] + ' II')
+        if rng.random() < 0.3:
+            cards.append(cards.pop(rng.randrange(len(cards))))
+        index = app_module.patch_search_index(index, *zip(*cards))
+        assert index == app_module.build_search_index(*zip(*cards))
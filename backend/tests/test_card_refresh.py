@@ -0,0 +1,113 @@
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def card(card_id, name, desc='Normal monster'):
+    return {'id': card_id, 'name': name, 'type': 'Normal Monster', 'desc': desc}
+
+
+class YGOPRODeckStub(BaseHTTPRequestHandler):
+    # Serves checkDBVer.php and cardinfo.php from the test's state dict, honouring If-None-Match like the real API
+    state = None
+
+    def do_GET(self):
+        state = self.state
+        state['requests'].append(self.path)
+        if self.path.startswith('/checkDBVer.php'):
+            body = json.dumps([{'database_version': state['dbver']}]).encode()
+        elif self.headers.get('If-None-Match') == state['etag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        else:
+            body = json.dumps({'data': state['cards']}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.startswith('/cardinfo.php'):
+            self.send_header('ETag', state['etag'])
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ygoprodeck(app_module, monkeypatch):
+    state = {'dbver': '1', 'etag': '"v1"', 'cards': [], 'requests': []}
+    handler = type('Handler', (YGOPRODeckStub,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    monkeypatch.setattr(app_module, 'YGOPRODECK_DBVER_URL', f'{base}/checkDBVer.php')
+    monkeypatch.setattr(app_module, 'YGOPRODECK_CARDS_URL', f'{base}/cardinfo.php')
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def publish(app_module, state, dbver, cards):
+    state.update(dbver=dbver, etag=f'"{dbver}"', cards=cards)
+    diff = app_module.refresh_card_catalog()
+    assert diff is not None
+    return diff
+
+
+def catalog_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT id, pos, name, hash, summary, data FROM cards ORDER BY pos').fetchall()
+    finally:
+        conn.close()
+
+
+def test_unchanged_dbver_skips_the_download(app_module, ygoprodeck):
+    publish(app_module, ygoprodeck, 'dbver-a', [card(1, 'Dark Magician')])
+    generation = app_module.read_catalog_generation()
+    ygoprodeck['requests'].clear()
+    assert app_module.refresh_card_catalog() is None
+    assert ygoprodeck['requests'] == ['/checkDBVer.php']
+    assert app_module.read_catalog_generation() == generation
+
+
+def test_not_modified_dump_is_skipped(app_module, ygoprodeck):
+    publish(app_module, ygoprodeck, 'dbver-b', [card(1, 'Dark Magician')])
+    generation = app_module.read_catalog_generation()
+    # The version changed but the dump didn't: the stored ETag gets a 304
+    ygoprodeck['dbver'] = 'dbver-c'
+    ygoprodeck['requests'].clear()
+    assert app_module.refresh_card_catalog() is None
+    assert ygoprodeck['requests'] == ['/checkDBVer.php', '/cardinfo.php']
+    assert app_module.read_catalog_generation() == generation
+
+
+def test_refresh_applies_the_diff(app_module, ygoprodeck, tmp_path):
+    publish(app_module, ygoprodeck, 'dbver-d', [
+        card(1, 'Dark Magician'), card(2, 'Blue-Eyes White Dragon'), card(3, 'Kuriboh'), card(4, 'Pot of Greed'),
+        card(5, 'Mirror Force'),
+    ])
+    cards = [
+        card(5, 'Mirror Force'),                              # moved
+        card(1, 'Dark Magician', desc='The ultimate wizard'),  # changed
+        card(6, 'Red-Eyes Black Dragon'),                     # added
+        card(3, 'Kuriboh'),
+        card(4, 'Pot of Avarice'),                            # renamed
+    ]                                                         # 2 removed
+    diff = publish(app_module, ygoprodeck, 'dbver-e', cards)
+    assert diff['added'] == ['6']
+    assert sorted(diff['changed']) == ['1', '4']
+    assert diff['removed'] == ['2']
+    assert (0, '5') in diff['moved']
+
+    catalog = app_module.CARD_CATALOG
+    assert catalog['meta']['dbver'] == 'dbver-e'
+    with open(app_module.CARDS_JSON, encoding='utf-8') as f:
+        assert json.load(f)['data'] == cards
+    rebuilt = app_module.build_card_catalog(app_module.CARDS_JSON, str(tmp_path / 'rebuilt.db'))
+    assert catalog_rows(catalog['path']) == catalog_rows(rebuilt)
+    assert catalog['index'] == app_module.build_search_index([str(c['id']) for c in cards], [c['name'] for c in cards])
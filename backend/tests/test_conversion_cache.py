@@ -0,0 +1,54 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+import converter
+
+
+def test_cache_key_depends_on_source_type(app_module):
+    digest = 'ab' * 32
+    keys = {app_module.conversion_cache_key(digest, name, 'pdf') for name in ('notes.txt', 'notes.md', 'notes.html')}
+    assert len(keys) == 3
+
+
+@pytest.mark.skipif(not os.path.exists(converter.WKHTMLTOPDF_PATH), reason='wkhtmltopdf is not installed')
+def test_same_bytes_as_txt_and_md_convert_differently(client):
+    text = b'# Heading\n\nSome *markdown* text.\n'
+    outputs = []
+    for name in ('notes.txt', 'notes.md', 'notes.txt'):
+        response = client.post('/api/convert', data={'format': 'pdf', 'file': (io.BytesIO(text), name)})
+        assert response.status_code == 200
+        outputs.append(response.data)
+    assert outputs[0] != outputs[1]
+    # The second .txt conversion is a cache hit and matches the first
+    assert outputs[2] == outputs[0]
+
+
+@pytest.fixture
+def scratch_on_other_filesystem(app_module, monkeypatch):
+    # e.g. SCRATCH_DIR on a tmpfs while jobs/ and the conversion cache are on disk
+    if not os.path.isdir('/dev/shm') or os.stat('/dev/shm').st_dev == os.stat(app_module.JOB_FILES_DIR).st_dev:
+        pytest.skip('no second filesystem to put the scratch directory on')
+    monkeypatch.setattr(app_module, 'SCRATCH_DIR', tempfile.mkdtemp(dir='/dev/shm'))
+
+
+def test_cache_hit_with_scratch_on_another_filesystem(app_module, client, scratch_on_other_filesystem):
+    docx = pytest.importorskip('docx')
+    document = docx.Document()
+    document.add_paragraph('Cross-device cache hit')
+    data = io.BytesIO()
+    document.save(data)
+    hits = app_module.conversion_cache_stats['hits']
+    jobs = app_module.job_store_summary()['jobs']
+    for _ in range(2):
+        response = client.post('/api/convert', data={'format': 'txt', 'file': (io.BytesIO(data.getvalue()), 'a.docx')})
+        assert response.status_code == 200
+        assert response.data == b'Cross-device cache hit\n'
+        response.close()
+    assert app_module.conversion_cache_stats['hits'] == hits + 1
+    assert not os.listdir(app_module.SCRATCH_DIR)
+    # The one-shot API's jobs are gone once their response is sent
+    assert not os.listdir(app_module.JOB_FILES_DIR)
+    assert app_module.job_store_summary()['jobs'] == jobs
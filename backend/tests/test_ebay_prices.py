@@ -0,0 +1,33 @@
+import pytest
+
+CARD = {'id': 46986414, 'name': 'Dark Magician'}
+LISTING = {'title': 'Dark Magician LOB-005', 'price': '3.50 GBP', 'condition': 'Used', 'url': 'https://ebay.example/1'}
+
+
+@pytest.fixture
+def catalog_card(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_catalog_cards_by_name', lambda catalog, names: {CARD['name']: CARD})
+
+
+def failing_lookup(card_name, region):
+    raise RuntimeError('eBay is down')
+
+
+def test_snapshot_is_returned_next_to_cached_listings(app_module, client, catalog_card):
+    app_module.store_ebay_prices(CARD['name'], 'GB', [LISTING])
+    app_module.store_price_snapshots({CARD['name']: ('LOB-005', 2.99, 'https://ebay.example/2')}, 'GB')
+    data = client.get('/api/yugioh/ebay-prices?name=Dark Magician&region=GB').get_json()
+    assert data['source'] == 'snapshot'
+    assert data['results'] == [LISTING]
+    assert data['snapshot']['price'] == '2.99 GBP'
+    assert data['snapshot']['url'] == 'https://ebay.example/2'
+
+
+def test_failed_fresh_lookup_is_flagged(app_module, client, catalog_card, monkeypatch):
+    monkeypatch.setattr(app_module, 'fetch_ebay_prices_once', failing_lookup)
+    app_module.store_ebay_prices(CARD['name'], 'US', [LISTING])
+    data = client.get('/api/yugioh/ebay-prices?name=Dark Magician&region=US&fresh=1').get_json()
+    assert data == {'results': [LISTING], 'source': 'cache'}
+
+    response = client.get('/api/yugioh/ebay-prices?name=Dark Magician&region=DE&fresh=1')
+    assert response.status_code == 502
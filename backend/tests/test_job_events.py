@@ -0,0 +1,31 @@
+import io
+import threading
+
+
+def test_event_stream_follows_job_until_ready(app_module, client):
+    job_id = app_module.create_job('convert', 'out.pdf')
+    response = client.get(f'/api/convert/events?job_id={job_id}', buffered=False)
+    stream = response.response
+    assert next(stream).startswith(b'event: progress')
+
+    threading.Timer(0.2, app_module.add_job_event, (job_id, 'progress', {'progress': 50}, 50)).start()
+    assert b'"progress": 50' in next(stream)
+    threading.Timer(0.2, app_module.fail_job, (job_id, 'Conversion failed')).start()
+    assert next(stream).startswith(b'event: error')
+    response.close()
+
+
+def test_long_requests_share_a_capped_budget(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'long_request_slots', threading.BoundedSemaphore(1))
+    job_id = app_module.create_job('convert', 'out.pdf')
+    first = client.get(f'/api/convert/events?job_id={job_id}', buffered=False)
+    second = client.get(f'/api/convert/events?job_id={job_id}', buffered=False)
+    assert first.status_code == 200
+    assert second.status_code == 503
+    assert second.headers['Retry-After']
+    convert = client.post('/api/convert', data={'format': 'txt', 'file': (io.BytesIO(b'x'), 'a.docx')})
+    assert convert.status_code == 503
+    first.close()
+    third = client.get(f'/api/convert/events?job_id={job_id}', buffered=False)
+    assert third.status_code == 200
+    third.close()
@@ -5,13 +5,14 @@ export default function CardSearchBar({ onAddCard }) {
     const [results, setResults] = useState([]);
     const [loading, setLoading] = useState(false);
     const [hoveredCard, setHoveredCard] = useState(null);
+    const [error, setError] = useState('');
 
     useEffect(() => {
         const delay = setTimeout(() => {
             if (query.length < 2) return setResults([]);
 
             setLoading(true);
-            fetch(`/api/yugioh/search?q=${encodeURIComponent(query)}`)
+            fetch(`/api/yugioh/search?q=${encodeURIComponent(query)}&mode=ranked`)
                 .then(res => res.json())
                 .then(data => setResults(data.results || []))
                 .catch(() => setResults([]))
@@ -21,6 +22,24 @@ export default function CardSearchBar({ onAddCard }) {
         return () => clearTimeout(delay);
     }, [query]);
 
+    // Search results are slim summaries; fetch the full card (sets, prices) before adding it to the deck
+    const handleSelect = (card) => {
+        setError('');
+        fetch('/api/yugioh/cards', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ids: [card.id.toString()] })
+        })
+            .then(res => res.json())
+            .then(data => {
+                if (!data.data?.[0]) throw new Error();
+                onAddCard(data.data[0]);
+            })
+            .catch(() => setError(`Could not add ${card.name}, please try again.`));
+        setQuery('');
+        setResults([]);
+    };
+
     return (
         <div style={{ marginTop: '1.5rem', position: 'relative' }}>
             <input
@@ -39,6 +58,7 @@ export default function CardSearchBar({ onAddCard }) {
                 }}
             />
             {loading && <p style={{ color: 'var(--text-secondary)' }}>Searching…</p>}
+            {error && <p style={{ color: '#ff4c4c', fontSize: '0.95rem' }}>{error}</p>}
 
             {results.length > 0 && (
                 <div style={{ display: 'flex', position: 'relative' }}>
@@ -62,7 +82,7 @@ export default function CardSearchBar({ onAddCard }) {
                                 style={{ display: 'flex', alignItems: 'center', padding: '0.5rem' }}
                             >
                                 <img
-                                    src={card.card_images?.[0]?.image_url_small}
+                                    src={card.image_url_small}
                                     alt={card.name}
                                     style={{
                                         width: '40px',
@@ -73,11 +93,7 @@ export default function CardSearchBar({ onAddCard }) {
                                     }}
                                 />
                                 <button
-                                    onClick={() => {
-                                        onAddCard(card);
-                                        setQuery('');
-                                        setResults([]);
-                                    }}
+                                    onClick={() => handleSelect(card)}
                                     style={{
                                         background: 'none',
                                         color: 'var(--primary-color)',
@@ -94,7 +110,7 @@ export default function CardSearchBar({ onAddCard }) {
                         ))}
                     </ul>
 
-                    {hoveredCard?.card_images?.[0]?.image_url && (
+                    {hoveredCard?.image_url && (
                         <div style={{
                             position: 'absolute',
                             left: 'calc(100% + 1rem)',
@@ -103,7 +119,7 @@ export default function CardSearchBar({ onAddCard }) {
                             zIndex: 1
                         }}>
                             <img
-                                src={hoveredCard.card_images[0].image_url}
+                                src={hoveredCard.image_url}
                                 alt={hoveredCard.name}
                                 style={{ width: '100%', borderRadius: '6px', boxShadow: '0 0 12px rgba(0,0,0,0.4)' }}
                             />
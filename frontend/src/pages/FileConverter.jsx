@@ -1,4 +1,4 @@
-import React, { useState, useMemo } from 'react';
+import React, { useState, useMemo, useRef, useEffect } from 'react';
 import styles from './FileConverter.module.css';
 import PageWrapper from '../components/PageWrapper';
 import PageTitle from '../components/PageTitle';
@@ -22,6 +22,9 @@ export default function FileConverter() {
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState('');
     const [downloadUrl, setDownloadUrl] = useState('');
+    const eventsRef = useRef(null);
+
+    useEffect(() => () => eventsRef.current && eventsRef.current.close(), []);
 
     const outputFormats = useMemo(() => (category ? formatOptions[category] : []), [category]);
 
@@ -56,30 +59,75 @@ export default function FileConverter() {
             return;
         }
 
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('format', format);
-
         setLoading(true);
         setError('');
         setDownloadUrl('');
 
+        if (category === 'audio') {
+            convertAudio();
+            return;
+        }
+
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('format', format);
+
         try {
-            const res = await fetch('/api/convert', {
+            const res = await fetch('/api/convert/start', {
                 method: 'POST',
                 body: formData
             });
 
-            if (!res.ok) throw new Error('Conversion failed');
+            if (res.status === 429) throw new Error('The converter is busy, please try again in a moment.');
+            if (!res.ok) throw new Error((await res.json().catch(() => ({}))).error || 'Conversion failed');
+
+            const data = await res.json();
+            watchConversion(data.job_id);
+        } catch (err) {
+            setError(err.message || 'An error occurred');
+            setLoading(false);
+        }
+    };
+
+    // Audio is transcoded on the fly: the raw file goes up as the request body and the converted audio streams back
+    const convertAudio = async () => {
+        try {
+            const res = await fetch(`/api/convert/audio?name=${encodeURIComponent(file.name)}&format=${format}`, {
+                method: 'POST',
+                body: file
+            });
+
+            if (res.status === 429) throw new Error('The converter is busy, please try again in a moment.');
+            if (!res.ok) throw new Error((await res.json().catch(() => ({}))).error || 'Conversion failed');
 
             const blob = await res.blob();
-            const url = window.URL.createObjectURL(blob);
-            setDownloadUrl(url);
+            if (downloadUrl.startsWith('blob:')) URL.revokeObjectURL(downloadUrl);
+            setDownloadUrl(URL.createObjectURL(blob));
         } catch (err) {
             setError(err.message || 'An error occurred');
+        } finally {
+            setLoading(false);
         }
+    };
 
-        setLoading(false);
+    // The conversion runs as a server-side job; its event stream ends with "ready" (and a download link) or "error"
+    const watchConversion = (job_id) => {
+        if (eventsRef.current) eventsRef.current.close();
+
+        const source = new EventSource(`/api/convert/events?job_id=${job_id}`);
+        eventsRef.current = source;
+        source.addEventListener('ready', (e) => {
+            source.close();
+            setDownloadUrl(JSON.parse(e.data).download_url);
+            setLoading(false);
+        });
+        source.addEventListener('error', (e) => {
+            // A dropped connection reconnects by itself and resumes from the last event id
+            if (!e.data && source.readyState === EventSource.CONNECTING) return;
+            source.close();
+            setError(e.data ? JSON.parse(e.data).error : 'Conversion failed');
+            setLoading(false);
+        });
     };
 
     return (
@@ -135,7 +183,7 @@ export default function FileConverter() {
                 {error && <p className={styles.error}>{error}</p>}
 
                 {downloadUrl && (
-                    <a href={downloadUrl} download className={styles.downloadButton}>
+                    <a href={downloadUrl} download={`${file.name.replace(/\.[^.]+$/, '')}.${format}`} className={styles.downloadButton}>
                         Download File
                     </a>
                 )}
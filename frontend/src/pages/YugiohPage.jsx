@@ -14,29 +14,10 @@ export default function DeckPriceLookup() {
 
     const [jobId, setJobId] = useState(null);
     const [progress, setProgress] = useState(0);
+    const [runningTotal, setRunningTotal] = useState(null);
     const [downloadReady, setDownloadReady] = useState(false);
     const [generationError, setGenerationError] = useState('');
-    const pollingRef = useRef(null);
-
-    const parseYdk = (text) => {
-        const lines = text.split(/\r?\n/);
-        const result = { main: [], extra: [], side: [] };
-        let currentSection = null;
-
-        for (const line of lines) {
-            const trimmed = line.trim().toLowerCase();
-            if (trimmed.startsWith('#') || trimmed.startsWith('!')) {
-                if (trimmed === '#main' || trimmed === '!main') currentSection = 'main';
-                else if (trimmed === '#extra' || trimmed === '!extra') currentSection = 'extra';
-                else if (trimmed === '#side' || trimmed === '!side') currentSection = 'side';
-                else currentSection = null;
-            } else if (trimmed && currentSection) {
-                result[currentSection].push(trimmed);
-            }
-        }
-
-        return result;
-    };
+    const eventsRef = useRef(null);
 
     const handleFileUpload = (e) => {
         const file = e.target.files[0];
@@ -45,41 +26,26 @@ export default function DeckPriceLookup() {
             return;
         }
 
-        const reader = new FileReader();
-        reader.onload = (event) => {
-            try {
-                const content = event.target.result;
-                const rawDeck = parseYdk(content);
-                const allIds = [...rawDeck.main, ...rawDeck.extra, ...rawDeck.side];
-
-                fetch('/api/yugioh/cards', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ ids: allIds })
-                })
-                    .then(res => res.json())
-                    .then(data => {
-                        if (!data.data) throw new Error('No card data returned');
-                        const lookup = Object.fromEntries(data.data.map(c => [c.id.toString(), c]));
+        // The server parses the .ydk and returns each card once plus per-section id/count lists
+        const formData = new FormData();
+        formData.append('file', file);
+        fetch('/api/yugioh/deck', { method: 'POST', body: formData })
+            .then(res => res.json())
+            .then(data => {
+                if (!data.cards) throw new Error(data.error || 'No card data returned');
+                const expand = (entries) => entries.flatMap(({ id, count }) => Array(count).fill(data.cards[id]));
 
-                        const fullDeck = {
-                            main: rawDeck.main.map(id => lookup[id]).filter(Boolean),
-                            extra: rawDeck.extra.map(id => lookup[id]).filter(Boolean),
-                            side: rawDeck.side.map(id => lookup[id]).filter(Boolean),
-                        };
-
-                        setDeck(fullDeck);
-                        setFileName(file.name);
-                        setError('');
-                    })
-                    .catch(() => {
-                        setError('Failed to load card data from server.');
-                    });
-            } catch {
-                setError('Failed to parse YDK file.');
-            }
-        };
-        reader.readAsText(file);
+                setDeck({
+                    main: expand(data.main),
+                    extra: expand(data.extra),
+                    side: expand(data.side),
+                });
+                setFileName(file.name);
+                setError('');
+            })
+            .catch(() => {
+                setError('Failed to load card data from server.');
+            });
     };
 
     const handleAddCard = (card) => {
@@ -136,53 +102,59 @@ export default function DeckPriceLookup() {
         setTimeout(() => URL.revokeObjectURL(url), 200);
     };
 
+    const slimDeck = (d) => Object.fromEntries(
+        ['main', 'extra', 'side'].map(section => [section, d[section].map(c => ({ id: c.id, name: c.name }))])
+    );
+
     const handleGenerateXLSX = async () => {
         const currency = region === 'GB' ? 'GBP' : 'USD';
         setJobId(null);
         setProgress(0);
+        setRunningTotal(null);
         setDownloadReady(false);
         setGenerationError('');
         try {
             const res = await fetch('/api/yugioh/ebay-xlsx/start', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ deck, currency }),
+                // The server resolves names and set codes from its catalog, so only ids are needed
+                body: JSON.stringify({ deck: slimDeck(deck), currency }),
             });
             if (!res.ok) throw new Error('Failed to start XLSX generation.');
             const data = await res.json();
             setJobId(data.job_id);
-            pollProgress(data.job_id);
+            watchProgress(data.job_id);
         } catch (e) {
             setGenerationError('Failed to start price spreadsheet generation.');
         }
     };
 
-    const pollProgress = (job_id) => {
-        if (pollingRef.current) clearInterval(pollingRef.current);
-
-        pollingRef.current = setInterval(async () => {
-            try {
-                const res = await fetch(`/api/yugioh/ebay-xlsx/progress?job_id=${job_id}`);
-                if (!res.ok) throw new Error('Failed to fetch progress.');
-                const data = await res.json();
-                setProgress(data.progress || 0);
+    // The server pushes progress over one Server-Sent Events stream per job (a "card" event per priced card,
+    // "progress" while the sheet is built, then "ready" or "error")
+    const watchProgress = (job_id) => {
+        if (eventsRef.current) eventsRef.current.close();
 
-                if (data.error) {
-                    setGenerationError(data.error);
-                    setJobId(null);
-                    clearInterval(pollingRef.current);
-                }
-
-                if (data.ready) {
-                    setDownloadReady(true);
-                    clearInterval(pollingRef.current);
-                }
-            } catch (e) {
-                setGenerationError('Failed to fetch job progress.');
-                setJobId(null);
-                clearInterval(pollingRef.current);
-            }
-        }, 800);
+        const source = new EventSource(`/api/yugioh/ebay-xlsx/events?job_id=${job_id}`);
+        eventsRef.current = source;
+        const onProgress = (e) => {
+            const data = JSON.parse(e.data);
+            setProgress(data.progress || 0);
+            if (data.total !== undefined) setRunningTotal(data.total);
+        };
+        source.addEventListener('card', onProgress);
+        source.addEventListener('progress', onProgress);
+        source.addEventListener('ready', () => {
+            source.close();
+            setProgress(100);
+            setDownloadReady(true);
+        });
+        source.addEventListener('error', (e) => {
+            // A dropped connection reconnects by itself and resumes from the last event id
+            if (!e.data && source.readyState === EventSource.CONNECTING) return;
+            source.close();
+            setGenerationError(e.data ? JSON.parse(e.data).error : 'Failed to fetch job progress.');
+            setJobId(null);
+        });
     };
 
     const handleDownloadXLSX = () => {
@@ -202,6 +174,7 @@ export default function DeckPriceLookup() {
         setDownloadReady(false);
         setJobId(null);
         setProgress(0);
+        setRunningTotal(null);
     };
 
     const renderXLSXButton = () => {
@@ -217,6 +190,7 @@ export default function DeckPriceLookup() {
                     </div>
                     <div style={{ textAlign: 'center', marginTop: 6, color: '#666' }}>
                         Generating Spreadsheet… {progress}%
+                        {runningTotal !== null && ` · ${region === 'GB' ? '£' : '$'}${runningTotal.toFixed(2)} so far`}
                     </div>
                     {generationError && (
                         <div style={{ color: "#ff4c4c", marginTop: 8 }}>{generationError}</div>